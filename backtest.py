@@ -2,64 +2,181 @@
 import pandas as pd
 import numpy as np
 
-#custom transformer addins
-from sklearn.base import BaseEstimator, TransformerMixin
-
 #date handling
 import datetime as dt
 from dateutil.relativedelta import relativedelta
 
-#plotting packages
-import seaborn as sns
-import matplotlib.pyplot as plt
-
 #custom imports
-from utils import get_data, ZScorer
+from utils import get_data, quarter_ends
+from profiling import profiled
+
+
+def __getattr__(name):
+    #sklearn transformers live in transformers.py so importing backtest
+    #doesn't pull in sklearn - still importable from here
+    if name in ('DollarValue', 'TradingCosts', 'ZScorer'):
+        import transformers
+        return getattr(transformers, name)
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+@profiled('costs')
+def trading_costs(positions, prices=None, volume=None, commission=0.0,
+                  spread=0.0, impact=0.0, notional=1.0, multiplier=1.0,
+                  roll_mask=None, roll_cost=0.0):
+    '''
+    cost of trading a series (or dates x markets panel) of positions, in the
+    same return units as the positions - positions are fractions of capital,
+    costs are fractions of capital lost on each date
+
+    cost per unit traded = commission + spread / 2 + impact * sqrt(participation)
+    where participation is contracts traded over that date's volume. futures
+    also pay roll_cost per unit of position held on roll dates
+
+    params
+    ======
+    positions (array-like): target position for each date (and market)
+    prices (array-like): prices, needed for the volume model
+    volume (array-like): traded volume, enables the volume model - missing
+                         volume is charged no impact
+    commission (float/array-like): cost per unit traded, per market if vector
+    spread (float/array-like): fixed bid/ask spread as a fraction of price
+    impact (float/array-like): square-root impact coefficient
+    notional (float): capital the positions are a fraction of
+    multiplier (float/array-like): contract multiplier for futures
+    roll_mask (array-like): True on dates (and markets) a futures roll happens
+    roll_cost (float/array-like): cost per unit of position rolled
+
+    return
+    ======
+    np.ndarray of costs, same shape as positions
+    '''
+    positions = np.nan_to_num(np.asarray(positions, dtype=np.float64))
+    traded = np.abs(np.diff(positions, axis=0, prepend=0.0))
 
+    per_unit = np.asarray(commission, dtype=np.float64) + \
+                np.asarray(spread, dtype=np.float64) / 2
+    costs = traded * per_unit
 
+    if volume is not None and np.any(impact):
+        if prices is None:
+            raise ValueError('Prices are needed to size trades against volume.')
 
+        prices = np.asarray(prices, dtype=np.float64)
+        volume = np.asarray(volume, dtype=np.float64)
+        contracts = traded * notional / (prices * multiplier)
 
-class DollarValue(BaseEstimator, TransformerMixin):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            participation = np.where(volume > 0, contracts / volume, np.nan)
+
+        costs = costs + np.nan_to_num(traded * impact * np.sqrt(participation))
+
+    if roll_mask is not None:
+        rolled = np.abs(positions) * np.asarray(roll_mask, dtype=bool)
+        costs = costs + rolled * roll_cost
+
+    return costs
+
+
+@profiled('pnl')
+def dollar_value(df, initial_amount=100, costs_col=None):
+    #flat before the first signal, so the entry cost on the first bar counts
+    strat = df['signal'].shift(1, fill_value=0) * df['daily_returns'].fillna(0)
+    if costs_col is not None:
+        strat = strat - df[costs_col]
+
+    return strat.cumsum().apply(np.exp)
+
+
+def _lag(arr, periods):
+    #shift along dates, nothing held before the first signal
+    held = np.zeros_like(arr)
+    if periods < len(arr):
+        held[periods:] = arr[:len(arr) - periods]
+
+    return held
+
+
+@profiled('pnl')
+def portfolio_backtest(signals, returns, sizes=None, lag=1, compound=True,
+                       costs=None):
     '''
-    generating dollar values of returns using a custom transformer w/ Scikit built in.
-    Ultimately would like to use this in a custom SKL pipeline/featureunion
+    backtest a whole panel of markets at once. positions decided on a date earn
+    the next date's return (lag=1), same as dollar_value for a single series
+
+    params
+    ======
+    signals (pd.DataFrame/np.ndarray): (dates x markets) signals, -1 to 1,
+                                       nan treated as flat
+    returns (pd.DataFrame/np.ndarray): (dates x markets) returns, nan as 0
+    sizes (float/array-like): position size per unit of signal - scalar,
+                              per-market vector or (dates x markets) matrix.
+                              pnl is in units of sizes * returns, eg weights
+                              and returns or share counts and price changes
+    lag (int): dates between a signal and the return it earns
+    compound (bool): equity as exp(cumsum) of log returns, otherwise cumsum
+    costs (dict/array-like): keyword arguments for trading_costs, or a
+                             precomputed (dates x markets) cost matrix,
+                             charged on the date positions change
+
+    return
+    ======
+    dictionary with (dates x markets) 'positions', 'pnl', 'costs', 'turnover'
+    and per-date 'total_pnl', 'equity', 'total_turnover', 'gross_exposure' and
+    'net_exposure' - frames/series if signals was a dataframe
     '''
+    index = getattr(signals, 'index', None)
+    columns = getattr(signals, 'columns', None)
+
+    signal_arr = np.nan_to_num(np.asarray(signals, dtype=np.float64))
+    return_arr = np.nan_to_num(np.asarray(returns, dtype=np.float64))
+    if signal_arr.shape != return_arr.shape:
+        raise ValueError(f'Signals {signal_arr.shape} and returns {return_arr.shape} are not aligned')
 
-    def __init__(self, initial_amount=100.0, returns_col=None):
-        '''
-        initializer for dollar value functions
+    positions = signal_arr if sizes is None else \
+                    signal_arr * np.nan_to_num(np.asarray(sizes, dtype=np.float64))
 
-        params
-        ======
-        initial_amount (float): initial dollar amount to base analysis on
-        returns_col (str): columns of periodic pct returns in decimal format
+    held = _lag(positions, lag)
 
-        returns
-        =======
-        no return
-        '''
+    if costs is None:
+        cost_arr = np.zeros_like(positions)
 
-        self._initial_amount = initial_amount
-        self._returns_col = returns_col
+    elif isinstance(costs, dict):
+        cost_arr = trading_costs(positions, **costs)
 
-    def fit(self, X, y=None):
-        return self
+    else:
+        cost_arr = np.nan_to_num(np.asarray(costs, dtype=np.float64))
 
-    def transform(self, X, y=None):
-        if self._returns_col == None:
-            #if there is no returns column passed must catch and verify
-            raise ValueError('Returns not available, please specify a valid column.')
-        try:
-            return (X['signal'].shift(1) * X[self.returns_col]).cumsum().apply(np.exp)
+    pnl = held * return_arr - cost_arr
+    total_pnl = pnl.sum(axis=1)
 
-        except KeyError as kerr:
-            print(f'Error when generating final dollar value: {kerr})
+    #trades are changes in target position, the first date trades from flat
+    turnover = np.abs(np.diff(positions, axis=0, prepend=0.0))
 
+    ret = {
+        'positions': positions,
+        'pnl': pnl,
+        'costs': cost_arr,
+        'turnover': turnover,
+        'total_pnl': total_pnl,
+        'equity': np.exp(np.cumsum(total_pnl)) if compound else np.cumsum(total_pnl),
+        'total_turnover': turnover.sum(axis=1),
+        'gross_exposure': np.abs(held).sum(axis=1),
+        'net_exposure': held.sum(axis=1),
+    }
+
+    if index is not None:
+        for key, val in ret.items():
+            ret[key] = pd.DataFrame(val, index=index, columns=columns) \
+                        if val.ndim == 2 else pd.Series(val, index=index, name=key)
+
+    return ret
 
-#def dollar_value(df, initial_amount=100):
-#    return (df['signal'].shift(1) * df['daily_returns']).cumsum().apply(np.exp)
 
 def plot_macd(df):
+    import matplotlib.pyplot as plt
+
     buy_and_hold = df['price'].apply(np.log).diff(1).cumsum().apply(np.exp)
 
     fig, ax = plt.subplots(3,1)
@@ -70,6 +187,8 @@ def plot_macd(df):
 
 
 def plot_awesome(df):
+    import matplotlib.pyplot as plt
+
     buy_and_hold = df['price'].apply(np.log).diff(1).cumsum().apply(np.exp)
 
     fig, ax = plt.subplots(3,1)
@@ -79,6 +198,8 @@ def plot_awesome(df):
     plt.show()
 
 def plot_breakout(df, st, lt):
+    import matplotlib.pyplot as plt
+
     magnitude = df['{}_dma'.format(st)] - df['{}_dma'.format(lt)]
     buy_and_hold = df['price'].apply(np.log).diff(1).cumsum().apply(np.exp)
 
@@ -128,6 +249,44 @@ def implement_breakout(df, func, params=[]):
 
 
 
+def quantile_buckets(values, splits=10):
+    '''
+    quantile bucket of every value within its row, one rank per date across
+    the whole universe at once
+
+    params
+    ======
+    values (np.ndarray): panel of shape (dates, securities), nan if missing
+    splits (int): number of buckets
+
+    returns
+    =======
+    np.ndarray of ints the same shape as values - 0 holds the lowest values
+    of each row, splits - 1 the highest, -1 marks missing values. tied values
+    share the lowest rank among them, so always land in the same bucket
+    '''
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    missing = np.isnan(values)
+    count = values.shape[1] - missing.sum(axis=1, keepdims=True)
+
+    #nan sorts last, so valid values take ranks 0 to count - 1
+    order = np.argsort(values, axis=1, kind='stable')
+    ordered = np.take_along_axis(values, order, axis=1)
+
+    #each run of equal sorted values takes the position where it starts
+    position = np.arange(values.shape[1])
+    starts = np.ones(ordered.shape, dtype=bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    tied = np.maximum.accumulate(np.where(starts, position, 0), axis=1)
+
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, tied, axis=1)
+
+    buckets = ranks * splits // np.maximum(count, 1)
+    buckets[missing] = -1
+    return buckets
+
+
 def scoring_split(data: dict, splits=10, ranking_scores=[],
                 ranking_func=None) -> dict:
     '''
@@ -135,15 +294,21 @@ def scoring_split(data: dict, splits=10, ranking_scores=[],
 
     params
     ======
-    data (dict): dictionary of data of form {identifier : datapoint}
+    data (dict/pd.DataFrame/np.ndarray): dictionary of data of form
+                    {identifier : datapoint} for one date, or a panel of
+                    shape (dates, securities) scored date by date
     splits (int): number of buckets by which data is ranked
-    ranking_scores (list): attribution score for each split
-    ranking_func (func): function that compares two values for scoring
+    ranking_scores (list): attribution score for each split, lowest values
+                    first
+    ranking_func (func): vectorized transform of the data before ranking,
+                    eg np.negative to give the first score to the highest
+                    values
 
     returns
     =======
     dictionary containing each input identifier along with their bucket
-    attribution score
+    attribution score, or a panel of scores shaped like data with nan where
+    data is missing
 
 
     reqs
@@ -152,25 +317,32 @@ def scoring_split(data: dict, splits=10, ranking_scores=[],
     scoring attributions for each scenario
 
     '''
-    ret = dict()
-
     if len(ranking_scores) != splits:
         #unfort going against pep with the longer msg
         msg = f'Number of ranking splits {splits} does not equal number of scoring metrics {len(ranking_scores)}'
         raise ValueError(msg)
 
-    pct_splits = [1 / split for split in range(1, splits + 1)]
-    print(pct_splits)
+    if isinstance(data, dict):
+        identifiers = list(data)
+        values = np.array([list(data.values())], dtype=np.float64)
 
-    for identifier, datapoint in data.items():
-        #TODO: rank each datapoint in data dictionary based on input score
+    else:
+        values = np.asarray(data, dtype=np.float64)
 
+    if ranking_func is not None:
+        values = ranking_func(values)
 
-        #can i use itemgetter here? maybe a list comp works
-        pass
+    #extra nan slot so missing values (bucket -1) score nan
+    lookup = np.append(np.asarray(ranking_scores, dtype=np.float64), np.nan)
+    scores = lookup[quantile_buckets(values, splits)]
 
+    if isinstance(data, dict):
+        return dict(zip(identifiers, scores[0]))
 
-    return ret
+    if isinstance(data, pd.DataFrame):
+        return pd.DataFrame(scores, index=data.index, columns=data.columns)
+
+    return scores.reshape(np.shape(data))
 
 def aggregate_scoring(funcs=[], datas=[], param_list=[]) -> dict:
     '''
@@ -179,13 +351,17 @@ def aggregate_scoring(funcs=[], datas=[], param_list=[]) -> dict:
 
     params
     ======
-    funcs (list): list of scoring functions to apply
-    datas (list): list of dataframes over which scoring will be applied
-    param_list (list): list of parameters to apply to each function
+    funcs (list): list of ranking functions passed to scoring_split
+    datas (list): list of dictionaries or (dates, securities) panels over
+                  which scoring will be applied
+    param_list (list): list of parameters to apply to each function, dicts
+                  with 'splits' and 'ranking_scores'
 
     returns
     =======
-    dictionary containing each identifier's aggregate raw score
+    dictionary containing each identifier's aggregate raw score, or a panel
+    of aggregate scores aligned on every date and security seen. missing
+    scores add nothing, nan only where no factor scored
 
     reqs
     ====
@@ -194,7 +370,7 @@ def aggregate_scoring(funcs=[], datas=[], param_list=[]) -> dict:
     len_f = len(funcs)
     len_d = len(datas)
     len_p = len(param_list)
-    agg = dict()
+    agg = None
 
 
     if (len_f != len_d) or (len_d != len_p):
@@ -210,22 +386,31 @@ def aggregate_scoring(funcs=[], datas=[], param_list=[]) -> dict:
     for data, params, func in zip(datas, param_list, funcs):
         #not as generalizable as i would have liked but params make it easy
 
-        #scores data based on each input function and spits out score dict
+        #scores data based on each input function
         scores = scoring_split(data, params['splits'],
                               params['ranking_scores'], func)
 
+        if agg is None:
+            agg = dict(scores) if isinstance(scores, dict) else scores
+
         #map each id's score from input into aggregated scoring tally
-        for id, score in scores.items():
+        elif isinstance(scores, dict):
+            for id, score in scores.items():
+                total = agg.get(id, np.nan)
+                if np.isnan(total):
+                    agg[id] = score
+
+                elif not np.isnan(score):
+                    agg[id] = total + score
 
-            #checks if id already exists in aggregation function
-            if agg[id]:
-                agg[id] += score
+        elif isinstance(scores, pd.DataFrame):
+            agg = agg.add(scores, fill_value=0)
 
-            #cant add int to None datatype  :)
-            else:
-                agg[id] = score
+        else:
+            agg = np.where(np.isnan(agg), scores,
+                           np.where(np.isnan(scores), agg, agg + scores))
 
-    return agg
+    return dict() if agg is None else agg
 
 
 def main():
@@ -235,19 +420,24 @@ def main():
     df = get_data('SPY', start_date, end_date, 'Adj Close')
     df.set_index('Date', inplace=True)
 
-    #TODO: need to find a way to implement these out of current year, may be
-    #able to parse years and just pass these as parameters
-    rebals = [dt.date(year=dt.date.today().year,month=3,day=31),
-            dt.date(year=dt.date.today().year, month=6, day=30),
-            dt.date(year=dt.date.today().year, month=9, day=30),
-            dt.date(year=dt.date.today().year, month=12, day=31)]
+    #quarter end rebalances across the whole history, used as walk-forward
+    #fold boundaries
+    rebals = quarter_ends(start_date, end_date)
 
     #macd_df = macd_strat(df)
     #macd_stats = implement_macd(macd_df, macd_strat)
     #print(macd_stats)
+    from walkforward import walk_forward
+    wf = walk_forward({'SPY': df}, 'breakout', {'st': [10, 20, 50],
+                      'lt': [30, 100, 200]}, rebals=rebals,
+                      where=lambda p: p['st'] < p['lt'])
+    print(wf['folds'])
+
+    from strategies import AwesomeOscillator
     windows = [34, 50, 68]
 
-    implement_awesome_oscillator(df, awesome_oscillator_strategy, windows)
+    implement_awesome_oscillator(df, AwesomeOscillator([], windows)
+                                 .raw_awesome_oscillator_strategy, windows)
 
 
 
@@ -0,0 +1,352 @@
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+import tracemalloc
+
+
+#modules that must stay out of plain sizing/signal imports
+HEAVY_MODULES = ('matplotlib', 'seaborn', 'sklearn', 'pandas_datareader')
+
+#entry points short lived jobs import, and how long each may take
+IMPORT_BUDGETS = {
+    'riskengine': 1.5,
+    'strategies': 1.5,
+    'backtest': 1.5,
+    'utils': 1.5,
+}
+
+
+def import_time(module, repeat=3):
+    '''
+    cold import cost of a module, measured in a fresh interpreter each run
+
+    params
+    ======
+    module (str): module to import
+    repeat (int): fresh interpreters to time, fastest is kept
+
+    return
+    ======
+    dictionary with 'seconds' and the 'heavy' modules the import pulled in
+    '''
+    code = ('import sys, time; t = time.perf_counter(); '
+            f'import {module}; t = time.perf_counter() - t; '
+            'import json; print(json.dumps({"seconds": t, '
+            f'"heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))')
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], cwd=here,
+                             capture_output=True, text=True, check=True)
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    return min(runs, key=lambda run: run['seconds'])
+
+
+def check_imports(budgets=IMPORT_BUDGETS, repeat=3):
+    '''
+    guard against import-time regressions - every module must import without
+    plotting, sklearn or network readers and inside its time budget
+
+    return
+    ======
+    list of failure messages, empty if all modules pass
+    '''
+    failures = []
+    for module, budget in budgets.items():
+        result = import_time(module, repeat)
+        print(f"{module:<12} {result['seconds']:.3f}s "
+              f"(budget {budget:.1f}s) heavy={result['heavy']}")
+
+        if result['heavy']:
+            failures.append(f"{module} imports {', '.join(result['heavy'])}")
+
+        if result['seconds'] > budget:
+            failures.append(f"{module} took {result['seconds']:.3f}s, budget {budget}s")
+
+    return failures
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+#baselines are machine specific, save them with --save-baseline before comparing
+BASELINE_PATH = os.path.join(HERE, 'benchmark_baselines.json')
+
+#(markets, bars per market) of the synthetic panels in each suite
+SCALES = {
+    'hotpaths': [(1, 10**3), (1, 10**5), (100, 10**3), (1000, 10**3)],
+    'full': [(1, 10**3), (1, 10**5), (1, 10**6), (1, 10**7), (10, 10**6),
+             (100, 10**4), (1000, 10**3), (1000, 10**4)],
+}
+
+
+def load_csv(path=os.path.join(HERE, 'spx_futures.csv')):
+    '''
+    vendor csv as the strategies expect it, see ingest.read_vendor_csv
+    '''
+    from ingest import read_vendor_csv
+    return read_vendor_csv(path)
+
+
+def synthetic_frames(n_markets, n_bars, seed=0):
+    '''
+    random walk ohlcv frames shaped like load_csv, one per market
+
+    params
+    ======
+    n_markets (int): number of frames
+    n_bars (int): dates per frame
+    seed (int): seed of the random walk
+
+    return
+    ======
+    list of pandas dataframes
+    '''
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('1990-01-01', periods=n_bars, freq='min')
+    frames = []
+    for _ in range(n_markets):
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_bars)))
+        spread = close * rng.uniform(0, 0.01, n_bars)
+        frames.append(pd.DataFrame({
+            'Close': close,
+            'Volume': rng.integers(1_000, 1_000_000, n_bars).astype(np.float64),
+            'Open': close - spread * rng.uniform(-1, 1, n_bars),
+            'High': close + spread,
+            'Low': close - spread,
+            'price': close,
+        }, index=pd.Index(dates, name='Date')))
+
+    return frames
+
+
+def _breakout(df):
+    from strategies import breakout
+    return breakout(df, 50, 200)
+
+def _macd(df):
+    from strategies import macd_strat
+    return macd_strat(df, 12, 26, 9)
+
+def _awesome(df):
+    from strategies import AwesomeOscillator
+    return AwesomeOscillator([], [34]).raw_awesome_oscillator_strategy(df, [34])
+
+def _atr(df):
+    from riskengine import average_trading_range
+    return average_trading_range(df, 20)
+
+def _with_returns(df):
+    import numpy as np
+    df['daily_returns'] = np.log(df['price']).diff()
+    df['signal'] = np.sign(df['daily_returns'].fillna(0.0))
+    return df
+
+def _dollar_value(df):
+    from transformers import DollarValue
+    return DollarValue(returns_col='daily_returns').transform(df)
+
+def _with_signal(df):
+    import numpy as np
+    df['signal'] = np.sign(df['price'] - df['price'].rolling(50).mean())
+    return df
+
+def _simulate(df, engine=None):
+    from execution import simulate
+    return simulate(df, order_type='limit', offset=0.001, initial_set=0.02,
+                    trailing_risk=0.05, commission=0.0001, engine=engine)
+
+def _simulate_python(df):
+    return _simulate(df, engine='python')
+
+
+#case name -> (setup run untimed on a copy of each frame, timed function).
+#simulate runs the numba kernel when numba is installed, the warm-up pass in
+#run_hotpaths keeps its compile out of the timings
+CASES = {
+    'breakout': (None, _breakout),
+    'macd_strat': (None, _macd),
+    'raw_awesome_oscillator_strategy': (None, _awesome),
+    'average_trading_range': (None, _atr),
+    'DollarValue.transform': (_with_returns, _dollar_value),
+    'simulate': (_with_signal, _simulate),
+    'simulate[python]': (_with_signal, _simulate_python),
+}
+
+
+def _prepare(frames, setup):
+    #strategies add columns to their input, so every run gets fresh copies
+    frames = [df.copy() for df in frames]
+    return [setup(df) for df in frames] if setup is not None else frames
+
+
+def run_case(name, frames, repeat=3, memory=True):
+    '''
+    time one case over every frame of a dataset
+
+    params
+    ======
+    name (str): key of CASES
+    frames (list): dataframes the case runs over, one per market
+    repeat (int): timed runs, fastest is kept
+    memory (bool): extra run under tracemalloc for peak memory
+
+    return
+    ======
+    dictionary with seconds, bars per second and peak memory in mb
+    '''
+    setup, func = CASES[name]
+    bars = sum(len(df) for df in frames)
+
+    best = float('inf')
+    for _ in range(repeat):
+        inputs = _prepare(frames, setup)
+        start = time.perf_counter()
+        for df in inputs:
+            func(df)
+
+        best = min(best, time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        inputs = _prepare(frames, setup)
+        tracemalloc.start()
+        try:
+            for df in inputs:
+                func(df)
+
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+
+        finally:
+            tracemalloc.stop()
+
+    return {'seconds': best, 'bars_per_second': bars / best if best else None,
+            'peak_memory_mb': peak}
+
+
+def run_hotpaths(suite='hotpaths', cases=None, repeat=3, memory=True):
+    '''
+    benchmark every case on spx_futures.csv and the suite's synthetic panels
+
+    return
+    ======
+    dictionary of {case/dataset : result}, see run_case
+    '''
+    datasets = [('spx_futures', lambda: [load_csv()])]
+    datasets += [(f'{markets}x{bars}',
+                  lambda markets=markets, bars=bars: synthetic_frames(markets, bars))
+                 for markets, bars in SCALES[suite]]
+
+    #first calls pay for lazy imports (scipy, sklearn), keep that out of timings
+    for name in cases or CASES:
+        run_case(name, synthetic_frames(1, 500), repeat=1, memory=False)
+
+    results = dict()
+    for data_name, make in datasets:
+        frames = make()
+        for name in cases or CASES:
+            result = run_case(name, frames, repeat, memory)
+            result.update(markets=len(frames),
+                          bars=sum(len(df) for df in frames))
+            results[f'{name}/{data_name}'] = result
+
+            memory_mb = result['peak_memory_mb']
+            print(f"{name:<32} {data_name:>12} {result['seconds']:>9.4f}s "
+                  f"{result['bars_per_second']:>14,.0f} bars/s "
+                  f"{'' if memory_mb is None else f'{memory_mb:>9.1f} mb'}")
+
+        del frames
+
+    return results
+
+
+def load_baselines(path=BASELINE_PATH):
+    if not os.path.exists(path):
+        return dict()
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(results, path=BASELINE_PATH):
+    #merge so suites saved separately share one file
+    baselines = load_baselines(path)
+    baselines.update(results)
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+
+
+def compare(results, baselines, tolerance=0.25):
+    '''
+    regressions against stored baselines - throughput lower or peak memory
+    higher than the baseline by more than tolerance
+
+    return
+    ======
+    list of failure messages, empty if nothing regressed
+    '''
+    failures = []
+    for key, result in results.items():
+        base = baselines.get(key)
+        if base is None:
+            continue
+
+        if result['bars_per_second'] < base['bars_per_second'] * (1 - tolerance):
+            failures.append(f"{key} throughput {result['bars_per_second']:,.0f} "
+                            f"bars/s vs baseline {base['bars_per_second']:,.0f}")
+
+        if (result['peak_memory_mb'] is not None and
+                base.get('peak_memory_mb') is not None and
+                result['peak_memory_mb'] > base['peak_memory_mb'] * (1 + tolerance)):
+            failures.append(f"{key} peak memory {result['peak_memory_mb']:.1f} mb "
+                            f"vs baseline {base['peak_memory_mb']:.1f} mb")
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Package benchmarks')
+    parser.add_argument('suite', nargs='?', default='imports',
+                        choices=['imports', 'hotpaths', 'full'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--case', action='append', choices=list(CASES),
+                        help='only run this case, may be repeated')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the tracemalloc run for peak memory')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help='baseline json to compare against')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed fractional regression before failing')
+    args = parser.parse_args()
+
+    if args.suite == 'imports':
+        failures = check_imports(repeat=args.repeat)
+
+    else:
+        results = run_hotpaths(args.suite, args.case, args.repeat,
+                               not args.no_memory)
+        if args.save_baseline:
+            save_baselines(results, args.baseline)
+            failures = []
+
+        else:
+            failures = compare(results, load_baselines(args.baseline),
+                               args.tolerance)
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,14 @@
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 import datetime as dt
-import pandas_datareader.data as web
+import utils
+from indicators import rolling_mean
+from profiling import profiled
 
 
-def get_data(ticker, start_date, end_date=dt.datetime.today(), colname='Adj Close'):
-    try:
-        df = web.DataReader(name=ticker,data_source='yahoo',start=start_date,
-                            end=end_date)
-        df.set_index('Date', inplace=True)
-        df.index = pd.to_datetime(df.index)
-
-    except Exception as err:
-        print(err)
-
-    return df.rename(columns={colname:'price'}).reset_index()
+def get_data(ticker, start_date, end_date=dt.datetime.today(), colname='Adj Close',
+            store=None):
+    #same loader as the rest of the package so the local store is shared
+    return utils.get_data(ticker, start_date, end_date, colname, store)
 
 
 def returnize(df, colname = 'price'):
@@ -24,21 +16,31 @@ def returnize(df, colname = 'price'):
     return df.dropna()
 
 
-def strategy_return(df, initial_investment=100000):
-    df['strategy'] = df['position'].shift(1) * df['return']
-    df.dropna(inplace=True)
+@profiled('pnl')
+def strategy_return(df, initial_investment=100000, costs=None):
+    #costs: optional per-date trading costs in return units, see
+    #backtest.trading_costs
+    #flat before the first position, so the entry cost on the first bar counts
+    df['strategy'] = df['position'].shift(1, fill_value=0) * df['return']
+    if costs is not None:
+        df['strategy'] -= costs
+    df.dropna(subset=['strategy'], inplace=True)
     df['strategy_nominal'] = df['strategy'].cumsum().apply(np.exp) * initial_investment
     return df
 
 
+@profiled('signal')
 def strategy(df, fma, sma):
-    df[fma] = df['price'].rolling(fma).mean()
-    df[sma] = df['price'].rolling(sma).mean()
+    df[fma] = rolling_mean(df['price'], fma)
+    df[sma] = rolling_mean(df['price'], sma)
     df['dist'] = df[fma] - df[sma]
     df['position'] = np.where((df[fma] > df[sma]) & (df['dist'] > df['dist'].rolling(sma).mean()), 1, -1)
     return df
 
 def main():
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     #crude futures
     ticker = 'CL=F'
     end = dt.date.today()
@@ -0,0 +1,259 @@
+import os
+import datetime as dt
+import pandas as pd
+import numpy as np
+
+
+class MarketDataStore(object):
+    '''
+    persistent local store of daily market data. each ticker is kept in its own
+    feather file with one column per field (High, Low, Close, Adj Close, ...),
+    so reads are keyed by ticker and column and can be memory-mapped. only the
+    missing dates are fetched from the network, everything else is served from
+    disk (or from memory on repeated reads within a process)
+
+    params
+    ======
+    root (str): directory holding the feather files
+    source (func): function of form source(ticker, start, end) returning a
+                   frame indexed by date - defaults to utils.download_data
+    offline (bool): never touch the network, serve whatever is on disk
+    '''
+
+    def __init__(self, root='market_data', source=None, offline=False):
+        self.__root = root
+        self.__source = source
+        self.__offline = offline
+
+        #tables already mapped this process, keyed by ticker -> (mtime, table)
+        self.__tables = dict()
+
+        os.makedirs(root, exist_ok=True)
+
+
+    #getters
+    def get_root(self):
+        return self.__root
+
+    def get_offline(self):
+        return self.__offline
+
+    def get_source(self):
+        if self.__source is None:
+            from utils import download_data
+            self.__source = download_data
+
+        return self.__source
+
+
+    #setters
+    def set_offline(self, offline):
+        self.__offline = offline
+
+    def set_source(self, source):
+        self.__source = source
+
+
+    #file handling
+    def path(self, ticker):
+        #tickers like CL=F and ^GSPC are fine on disk, path separators are not
+        name = ticker.replace(os.sep, '_').replace('/', '_')
+        return os.path.join(self.get_root(), f'{name}.feather')
+
+    def tickers(self):
+        return sorted(f[:-len('.feather')] for f in os.listdir(self.get_root())
+                      if f.endswith('.feather'))
+
+    def has(self, ticker):
+        return os.path.exists(self.path(ticker))
+
+    def _table(self, ticker):
+        '''
+        memory-mapped arrow table for ticker, re-mapped only if file changed
+        '''
+        from pyarrow import feather
+
+        path = self.path(ticker)
+        mtime = os.path.getmtime(path)
+        cached = self.__tables.get(ticker)
+
+        if cached is None or cached[0] != mtime:
+            table = feather.read_table(path, memory_map=True)
+            self.__tables[ticker] = (mtime, table)
+            return table
+
+        return cached[1]
+
+    def _fetched(self, ticker):
+        '''
+        date range already requested from source, even if it had no rows at
+        either end - falls back to first/last stored dates
+        '''
+        table = self._table(ticker)
+        meta = table.schema.metadata or {}
+        dates = table.column('Date')
+
+        since = meta.get(b'fetched_from')
+        through = meta.get(b'fetched_through')
+        since = pd.Timestamp(since.decode()) if since else \
+                    pd.Timestamp(dates[0].as_py())
+        through = pd.Timestamp(through.decode()) if through else \
+                    pd.Timestamp(dates[-1].as_py())
+
+        return since, through
+
+
+    #reads and writes
+    def read(self, ticker, start=None, end=None, columns=None):
+        '''
+        read stored history for ticker without touching the network
+
+        params
+        ======
+        ticker (str): ticker of security
+        start (datetime-like): first date to return, defaults to first stored
+        end (datetime-like): last date to return, defaults to last stored
+        columns (list): fields to return, defaults to all
+
+        return
+        ======
+        pandas dataframe indexed by Date
+        '''
+        table = self._table(ticker)
+        if columns is not None:
+            table = table.select(['Date'] + [c for c in columns if c != 'Date'])
+
+        #dates are written sorted so slicing is a pair of binary searches, done
+        #on the mapped table so only the requested rows are converted
+        dates = table.column('Date').to_numpy()
+        lo = 0 if start is None else np.searchsorted(dates,
+                                    np.datetime64(pd.Timestamp(start)), 'left')
+        hi = len(dates) if end is None else np.searchsorted(dates,
+                                    np.datetime64(pd.Timestamp(end)), 'right')
+        return table.slice(lo, hi - lo).to_pandas().set_index('Date')
+
+    def write(self, ticker, df, fetched_from=None, fetched_through=None):
+        '''
+        overwrite stored history for ticker
+
+        params
+        ======
+        ticker (str): ticker of security
+        df (pd.DataFrame): frame indexed by date (or with a Date column)
+        fetched_from (datetime-like): first date requested from source
+        fetched_through (datetime-like): last date requested from source
+        '''
+        import pyarrow as pa
+        from pyarrow import feather
+
+        if 'Date' in df.columns:
+            df = df.set_index('Date')
+
+        df = df.copy()
+        df.index = pd.to_datetime(df.index).rename('Date')
+        df = df[~df.index.duplicated(keep='last')].sort_index()
+
+        table = pa.Table.from_pandas(df.reset_index(), preserve_index=False)
+        meta = dict(table.schema.metadata or {})
+        for key, date in ((b'fetched_from', fetched_from),
+                          (b'fetched_through', fetched_through)):
+            if date is not None:
+                meta[key] = str(pd.Timestamp(date).date()).encode()
+
+        table = table.replace_schema_metadata(meta)
+
+        #write then rename so readers never map a half written file
+        path = self.path(ticker)
+        tmp = f'{path}.tmp'
+        feather.write_feather(table, tmp, compression='uncompressed')
+        os.replace(tmp, path)
+        self.__tables.pop(ticker, None)
+
+    def append(self, ticker, df, fetched_from=None, fetched_through=None):
+        '''
+        merge new rows into stored history, newer rows win on duplicate dates
+        '''
+        if 'Date' in df.columns:
+            df = df.set_index('Date')
+
+        if self.has(ticker):
+            since, through = self._fetched(ticker)
+            fetched_from = since if fetched_from is None else \
+                                min(since, pd.Timestamp(fetched_from))
+            fetched_through = through if fetched_through is None else \
+                                max(through, pd.Timestamp(fetched_through))
+
+            df = pd.concat([self.read(ticker), df])
+
+        self.write(ticker, df, fetched_from, fetched_through)
+
+    def update(self, ticker, start, end=None):
+        '''
+        fetch only the dates missing from the store between start and end
+
+        params
+        ======
+        ticker (str): ticker of security
+        start (datetime-like): first date needed
+        end (datetime-like): last date needed, defaults to today
+        '''
+        end = pd.Timestamp(dt.date.today() if end is None else end)
+        start = pd.Timestamp(start)
+        source = self.get_source()
+
+        if not self.has(ticker):
+            self.write(ticker, source(ticker, start, end), start, end)
+            return
+
+        since, through = self._fetched(ticker)
+
+        frames = []
+        if start < since:
+            frames.append(source(ticker, start, since - dt.timedelta(1)))
+
+        if end > through:
+            frames.append(source(ticker, through + dt.timedelta(1), end))
+
+        if frames:
+            self.append(ticker, pd.concat(frames), start, end)
+
+    def get(self, ticker, start, end=None, columns=None):
+        '''
+        read history for ticker, filling any missing dates from source first
+        unless the store is offline
+        '''
+        if not self.get_offline():
+            try:
+                self.update(ticker, start, end)
+
+            except Exception as err:
+                #stale data is better than none - fall back to what's on disk
+                if not self.has(ticker):
+                    raise
+
+                print(f'Could not refresh {ticker}, serving stored data: {err}')
+
+        return self.read(ticker, start, end, columns)
+
+    def seed_from_csv(self, ticker, path, date_format='%m/%d/%Y'):
+        '''
+        seed store from a vendor csv (eg spx_futures.csv) so it can run fully
+        offline
+
+        params
+        ======
+        ticker (str): ticker to store data under
+        path (str): path to csv file with a Date column
+        date_format (str): strftime format of the Date column
+        '''
+        from ingest import read_vendor_csv
+
+        #stored as the vendor gave it, price is added when read
+        df = read_vendor_csv(path, date_format, price_col=None)
+
+        #futures closes need no adjusting, so the close doubles as Adj Close
+        #for callers (get_data, RiskEngine) that read that column by default
+        if 'Adj Close' not in df.columns and 'Close' in df.columns:
+            df['Adj Close'] = df['Close']
+
+        self.append(ticker, df, df.index.min(), df.index.max())
@@ -0,0 +1,261 @@
+import numpy as np
+import pandas as pd
+from profiling import profiled
+
+
+#order types
+MARKET = 0
+LIMIT = 1
+STOP = 2
+
+ORDER_TYPES = {'market': MARKET, 'limit': LIMIT, 'stop': STOP}
+
+#what happened on a bar, last event wins when several happen
+NO_EVENT = 0
+MARKET_FILL = 1
+LIMIT_FILL = 2
+STOP_FILL = 3
+STOPPED_OUT = 4
+
+#compiled kernel, built on first use when numba is installed
+_compiled = dict()
+
+
+def _kernel(open_, high, low, close, target, kind, offset, initial_set,
+            trailing_risk, commission, position, fill, event, stop, pnl):
+    '''
+    bar by bar order matching. kept to plain loops over indexable inputs so
+    the same source runs under numba or as python over lists
+
+    an order for target is placed at each bar's close when the position
+    differs from it and works from the next bar until filled or replaced.
+    protective stops are checked against each bar's range with gaps filled
+    at the open, then trailed from the best price seen
+    '''
+    nan = np.nan
+
+    pos = 0.0
+    cash = 0.0
+    equity = 0.0
+
+    stop_level = nan
+    best = nan
+
+    #signal that got stopped out, no re-entry until the signal changes
+    blocked = nan
+    last_signal = nan
+
+    pending = False
+    desired = 0.0
+    order_price = nan
+
+    for i in range(len(close)):
+        o = open_[i]
+        hi = high[i]
+        lo = low[i]
+        cl = close[i]
+        signal = target[i]
+        bar_event = NO_EVENT
+        bar_fill = nan
+
+        #working order
+        if pending:
+            buy = desired > pos
+            px = nan
+            if kind == MARKET:
+                px = o
+
+            elif kind == LIMIT:
+                if buy and lo <= order_price:
+                    px = o if o < order_price else order_price
+
+                elif not buy and hi >= order_price:
+                    px = o if o > order_price else order_price
+
+            else:
+                if buy and hi >= order_price:
+                    px = o if o > order_price else order_price
+
+                elif not buy and lo <= order_price:
+                    px = o if o < order_price else order_price
+
+            if px == px:
+                qty = desired - pos
+                cash -= qty * px + abs(qty) * px * commission
+
+                #new direction gets new stops, adding to a position keeps them
+                if desired == 0.0:
+                    stop_level = nan
+
+                elif pos == 0.0 or (pos > 0.0) != (desired > 0.0):
+                    best = px
+                    stop_level = nan
+                    if initial_set > 0.0:
+                        if desired > 0.0:
+                            stop_level = px * (1.0 - initial_set)
+
+                        else:
+                            stop_level = px * (1.0 + initial_set)
+
+                pos = desired
+                pending = False
+                bar_fill = px
+                bar_event = kind + 1
+
+        #protective stop against the bar's range
+        if pos != 0.0 and stop_level == stop_level:
+            px = nan
+            if pos > 0.0 and lo <= stop_level:
+                px = o if o < stop_level else stop_level
+
+            elif pos < 0.0 and hi >= stop_level:
+                px = o if o > stop_level else stop_level
+
+            if px == px:
+                cash += pos * px - abs(pos) * px * commission
+                blocked = last_signal
+                pos = 0.0
+                stop_level = nan
+                pending = False
+                bar_fill = px
+                bar_event = STOPPED_OUT
+
+        #trail from the best price seen while in the position
+        if pos != 0.0 and trailing_risk > 0.0:
+            if pos > 0.0:
+                if hi > best:
+                    best = hi
+
+                trail = best * (1.0 - trailing_risk)
+                if stop_level != stop_level or trail > stop_level:
+                    stop_level = trail
+
+            else:
+                if lo < best:
+                    best = lo
+
+                trail = best * (1.0 + trailing_risk)
+                if stop_level != stop_level or trail < stop_level:
+                    stop_level = trail
+
+        value = cash + pos * cl
+        pnl[i] = value - equity
+        equity = value
+        position[i] = pos
+        fill[i] = bar_fill
+        event[i] = bar_event
+        stop[i] = stop_level
+
+        #order for the next bar from this bar's signal
+        if signal == signal:
+            last_signal = signal
+            if signal != blocked:
+                blocked = nan
+                if signal != pos:
+                    #priced once, a resting order doesn't chase the close
+                    if pending and signal == desired:
+                        continue
+
+                    pending = True
+                    desired = signal
+                    if kind == LIMIT:
+                        if signal > pos:
+                            order_price = cl * (1.0 - offset)
+
+                        else:
+                            order_price = cl * (1.0 + offset)
+
+                    elif kind == STOP:
+                        if signal > pos:
+                            order_price = cl * (1.0 + offset)
+
+                        else:
+                            order_price = cl * (1.0 - offset)
+
+                else:
+                    pending = False
+
+    return equity
+
+
+def _get_kernel(engine):
+    if engine == 'python':
+        return None
+
+    if 'numba' not in _compiled:
+        try:
+            from numba import njit
+            _compiled['numba'] = njit(cache=True, nogil=True)(_kernel)
+
+        except ImportError:
+            _compiled['numba'] = None
+
+    if engine == 'numba' and _compiled['numba'] is None:
+        raise ValueError('numba engine requested but numba is not installed')
+
+    return _compiled['numba']
+
+
+@profiled('execution')
+def simulate(df, signal_col='signal', order_type='market', offset=0.0,
+             initial_set=0.0, trailing_risk=0.0, commission=0.0, engine=None):
+    '''
+    event driven execution of a signal against ohlc bars. the signal on a bar
+    is the target position decided at its close, as in signal.shift(1) *
+    returns, but orders fill against the following bars' open/high/low and
+    stops can be hit inside a bar
+
+    params
+    ======
+    df (pd.DataFrame): Open, High, Low and Close (or price) plus signal_col
+    signal_col (str): column of target positions, nan keeps the last target
+    order_type (str): 'market' fills at the next open, 'limit' buys offset
+                      below (sells above) the close of the bar the target
+                      changed on, 'stop' buys offset above (sells below) it.
+                      unfilled orders keep working at that price until the
+                      target changes
+    offset (float): limit/stop distance from the close as a fraction
+    initial_set (float): stop set this fraction back from the entry price,
+                         0 for none (see strategies.BaseStrategy.set_stop)
+    trailing_risk (float): stop trailed this fraction back from the best
+                           price since entry, 0 for none
+    commission (float): cost per fill as a fraction of traded notional
+    engine (str): 'numba', 'python', or None for numba when installed
+
+    return
+    ======
+    pandas dataframe on df's index with position held at each close, fill
+    price and event of each bar, stop level carried into the next bar, and
+    pnl/equity in price points per unit of position
+    '''
+    if order_type not in ORDER_TYPES:
+        raise ValueError(f'Unknown order type {order_type}, use market, limit or stop')
+
+    close_col = 'Close' if 'Close' in df.columns else 'price'
+    cols = ['Open', 'High', 'Low', close_col, signal_col]
+    missing = [col for col in cols if col not in df.columns]
+    if missing:
+        raise ValueError(f'Missing columns {missing} for execution')
+
+    inputs = [df[col].to_numpy(dtype=np.float64) for col in cols]
+    params = (ORDER_TYPES[order_type], float(offset), float(initial_set),
+              float(trailing_risk), float(commission))
+    n = len(df)
+
+    kernel = _get_kernel(engine)
+    if kernel is not None:
+        outputs = [np.empty(n), np.empty(n), np.empty(n, dtype=np.int8),
+                   np.empty(n), np.empty(n)]
+        kernel(*inputs, *params, *outputs)
+
+    else:
+        #python indexes lists much faster than numpy arrays
+        outputs = [[0.0] * n for _ in range(5)]
+        _kernel(*[arr.tolist() for arr in inputs], *params, *outputs)
+        outputs = [np.asarray(out, dtype=np.int8 if k == 2 else np.float64)
+                   for k, out in enumerate(outputs)]
+
+    position, fill, event, stop, pnl = outputs
+    return pd.DataFrame({'position': position, 'fill_price': fill,
+                         'event': event, 'stop': stop, 'pnl': pnl,
+                         'equity': np.cumsum(pnl)}, index=df.index)
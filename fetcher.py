@@ -0,0 +1,275 @@
+import io
+import random
+import asyncio
+import threading
+import pandas as pd
+from urllib.parse import quote
+from profiling import profiled
+
+
+#errors that won't go away on a retry - missing tickers, unparseable data
+PERMANENT_ERRORS = (FileNotFoundError, LookupError, ValueError)
+
+
+class SourceBackend(object):
+    '''
+    fetch backend wrapping a blocking source(ticker, start, end) function,
+    each call runs on a worker thread so many tickers are in flight at once
+
+    params
+    ======
+    source (func): returns a frame indexed by date, defaults to
+                   utils.download_data
+    '''
+
+    def __init__(self, source=None):
+        self._source = source
+
+    def get_source(self):
+        if self._source is None:
+            from utils import download_data
+            self._source = download_data
+
+        return self._source
+
+    async def open(self):
+        return self
+
+    async def close(self):
+        pass
+
+    async def fetch(self, ticker, start, end):
+        return await asyncio.to_thread(self.get_source(), ticker, start, end)
+
+
+class StoreBackend(SourceBackend):
+    '''
+    fetch backend serving a datastore.MarketDataStore - only dates missing
+    from the store are downloaded, or none at all when it is offline
+    '''
+
+    def __init__(self, store):
+        super().__init__(store.get)
+        self._store = store
+
+    def get_store(self):
+        return self._store
+
+
+class HTTPBackend(object):
+    '''
+    fetch backend for csv (or other) data over http through one pooled
+    session - aiohttp when installed, otherwise a requests session whose
+    blocking calls run on worker threads
+
+    params
+    ======
+    url (str): template with {ticker}, {start} and {end} (YYYY-MM-DD), eg
+               'http://localhost:8000/{ticker}.csv?start={start}&end={end}'
+    parse (func): bytes -> frame indexed by date, defaults to a vendor csv
+                  read by ingest.read_vendor_csv
+    pool_size (int): connections kept open
+    timeout (float): seconds per request
+    '''
+
+    def __init__(self, url, parse=None, pool_size=16, timeout=30.0):
+        self._url = url
+        self._parse = parse
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._session = None
+        self._aiohttp = None
+
+    def _parse_body(self, body):
+        if self._parse is not None:
+            return self._parse(body)
+
+        from ingest import read_vendor_csv
+        return read_vendor_csv(io.BytesIO(body), price_col=None)
+
+    async def open(self):
+        try:
+            import aiohttp
+            self._aiohttp = aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._pool_size),
+                timeout=aiohttp.ClientTimeout(total=self._timeout))
+
+        except ImportError:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self._pool_size,
+                                  pool_maxsize=self._pool_size)
+            self._session.mount('http://', adapter)
+            self._session.mount('https://', adapter)
+
+        return self
+
+    async def close(self):
+        if self._session is None:
+            return
+
+        if self._aiohttp is not None:
+            await self._session.close()
+
+        else:
+            self._session.close()
+
+        self._session = None
+
+    def _get(self, url):
+        with self._session.get(url, timeout=self._timeout) as resp:
+            return resp.status_code, resp.content
+
+    async def fetch(self, ticker, start, end):
+        url = self._url.format(ticker=quote(ticker, safe=''),
+                               start=f'{pd.Timestamp(start):%Y-%m-%d}',
+                               end=f'{pd.Timestamp(end):%Y-%m-%d}')
+
+        if self._aiohttp is not None:
+            async with self._session.get(url) as resp:
+                status, body = resp.status, await resp.read()
+
+        else:
+            status, body = await asyncio.to_thread(self._get, url)
+
+        if status == 404:
+            raise FileNotFoundError(f'{ticker} not found at {url}')
+
+        if status == 429 or status >= 500:
+            raise ConnectionError(f'{url} returned {status}')
+
+        if status >= 400:
+            raise ValueError(f'{url} returned {status}')
+
+        return await asyncio.to_thread(self._parse_body, body)
+
+
+async def _fetch_one(backend, ticker, start, end, semaphore, retries, backoff,
+                     timeout):
+    '''
+    one ticker with retries and jittered exponential backoff, errors are
+    returned rather than raised so they stay with their ticker
+    '''
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                return ticker, await asyncio.wait_for(
+                            backend.fetch(ticker, start, end), timeout), None
+
+        except PERMANENT_ERRORS as err:
+            return ticker, None, err
+
+        except Exception as err:
+            if attempt == retries:
+                return ticker, None, err
+
+            await asyncio.sleep(backoff * 2 ** attempt * (0.5 + random.random()))
+
+
+async def fetch_async(tickers, start, end, backend=None, concurrency=8,
+                      retries=3, backoff=0.5, timeout=None):
+    '''
+    fetch many tickers concurrently, see fetch
+    '''
+    backend = SourceBackend() if backend is None else backend
+    semaphore = asyncio.Semaphore(concurrency)
+
+    await backend.open()
+    try:
+        results = await asyncio.gather(*[
+            _fetch_one(backend, ticker, start, end, semaphore, retries,
+                       backoff, timeout) for ticker in tickers])
+
+    finally:
+        await backend.close()
+
+    frames = {ticker: df for ticker, df, err in results if err is None}
+    errors = {ticker: err for ticker, df, err in results if err is not None}
+    return frames, errors
+
+
+def _run(coro):
+    #asyncio.run can't nest, so inside a running loop (eg a notebook) the
+    #fetch gets a loop of its own on a thread
+    try:
+        asyncio.get_running_loop()
+
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = dict()
+    thread = threading.Thread(target=lambda: result.update(
+                                    value=asyncio.run(coro)))
+    thread.start()
+    thread.join()
+    return result['value']
+
+
+@profiled('load')
+def fetch(tickers, start, end, backend=None, concurrency=8, retries=3,
+          backoff=0.5, timeout=None):
+    '''
+    fetch daily history for many tickers at once with bounded concurrency,
+    retrying transient failures. a ticker that still fails is reported in
+    errors without affecting the others
+
+    params
+    ======
+    tickers (list): tickers to fetch
+    start (datetime-like): first date of history
+    end (datetime-like): last date of history
+    backend (object): SourceBackend (default, utils.download_data on threads),
+                      StoreBackend, HTTPBackend or any object with async
+                      open(), close() and fetch(ticker, start, end)
+    concurrency (int): most requests in flight at once
+    retries (int): retries per ticker after the first attempt
+    backoff (float): seconds before the first retry, doubling after each
+    timeout (float): seconds allowed per attempt, None for no limit
+
+    return
+    ======
+    ({ticker : dataframe}, {ticker : exception})
+    '''
+    return _run(fetch_async(tickers, start, end, backend, concurrency,
+                            retries, backoff, timeout))
+
+
+def fetch_universe(tickers, start, end, colname='Adj Close', store=None,
+                   backend=None, concurrency=8, retries=3):
+    '''
+    fetch frames shaped like utils.get_data (Date column, price taken from
+    colname) for every ticker, printing and leaving out the ones that fail
+    or have no colname
+
+    params
+    ======
+    colname (str): column used as the price series, kept as well so eg
+                   'Close' is still there for atr
+    store (datastore.MarketDataStore): serve from the store when no backend
+                                       is given
+
+    see fetch for remaining params
+
+    return
+    ======
+    (list of tickers fetched, list of their frames, {ticker : exception})
+    '''
+    if backend is None and store is not None:
+        backend = StoreBackend(store)
+
+    frames, errors = fetch(tickers, start, end, backend, concurrency, retries)
+    for ticker, df in list(frames.items()):
+        if colname not in df.columns:
+            errors[ticker] = ValueError(f'no {colname} column, has '
+                                      f'{list(df.columns)}')
+            del frames[ticker]
+
+    for ticker, err in errors.items():
+        print(f'Could not fetch {ticker}: {err}')
+
+    fetched = [ticker for ticker in tickers if ticker in frames]
+    return fetched, [frames[ticker].assign(price=frames[ticker][colname])
+                     .reset_index() for ticker in fetched], errors
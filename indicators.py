@@ -0,0 +1,122 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from utils import ewma
+
+
+class IndicatorCache(object):
+    '''
+    memoizes indicators computed over price series so an ensemble of strategies
+    run over the same data computes each (series, indicator, window) once.
+
+    series are keyed by a hash of their contents, so copies of a frame share
+    entries and in place edits miss. only the indicator values are kept, never
+    the input buffers. least recently used entries are evicted once maxsize is
+    reached
+
+    params
+    ======
+    maxsize (int): max number of indicator arrays to keep
+    '''
+
+    def __init__(self, maxsize=256):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    #getters
+    def get_maxsize(self):
+        return self._maxsize
+
+    def get_info(self):
+        return {'hits': self._hits, 'misses': self._misses,
+                'size': len(self._entries), 'maxsize': self._maxsize}
+
+    #setters
+    def set_maxsize(self, maxsize):
+        self._maxsize = maxsize
+        self._evict()
+
+    #worker functions
+    @staticmethod
+    def _identity(series):
+        #one pass over the values, about half the cost of a rolling mean
+        arr = np.ascontiguousarray(series.to_numpy())
+        if arr.dtype == object:
+            arr = arr.astype(np.float64)
+
+        digest = hashlib.blake2b(arr.view(np.uint8), digest_size=16).digest()
+        return (arr.shape, arr.dtype.str, digest)
+
+    def _evict(self):
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, inputs, kind, window, func):
+        '''
+        cached indicator values, computed with func on a miss
+
+        params
+        ======
+        inputs (tuple): pandas series the indicator is computed from
+        kind (str): name of indicator, eg 'sma'
+        window: window/span/parameters of the indicator (hashable)
+        func (func): computes the indicator from inputs, returns array-like
+
+        return
+        ======
+        pandas series aligned to the first input
+        '''
+        key = (tuple(self._identity(series) for series in inputs), kind, window)
+
+        values = self._entries.get(key)
+        if values is None:
+            self._misses += 1
+            values = np.array(func(*inputs), dtype=np.float64)
+            values.flags.writeable = False
+            self._entries[key] = values
+            self._evict()
+
+        else:
+            self._hits += 1
+            self._entries.move_to_end(key)
+
+        return pd.Series(values, index=inputs[0].index, copy=False)
+
+
+#one cache per process, shared by every strategy
+_cache = IndicatorCache()
+
+
+def get_cache():
+    return _cache
+
+
+def rolling_mean(series, window):
+    '''
+    simple moving average of series over window
+    '''
+    return _cache.get((series,), 'sma', window,
+                      lambda s: s.rolling(window).mean())
+
+
+def ewm_mean(series, span):
+    '''
+    exponentially weighted moving average of series with given span
+    '''
+    return _cache.get((series,), 'ewm', span,
+                      lambda s: ewma(s.to_numpy(dtype=np.float64), span=span))
+
+
+def median_price(high, low):
+    '''
+    midpoint of each bar's range
+    '''
+    return _cache.get((high, low), 'median', None, lambda h, l: (h + l) / 2)
@@ -0,0 +1,297 @@
+import os
+import glob
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+
+#vendor date format, eg 12/4/2020 in spx_futures.csv
+DATE_FORMAT = '%m/%d/%Y'
+
+#stripped, lower cased vendor headers -> names the strategies use
+COLUMN_ALIASES = {
+    'date': 'Date',
+    'open': 'Open',
+    'high': 'High',
+    'low': 'Low',
+    'close': 'Close',
+    'close/last': 'Close',
+    'last': 'Close',
+    'adj close': 'Adj Close',
+    'volume': 'Volume',
+}
+
+#cache of a directory, one array per field across all of its files
+CACHE_DIR = '.ingest_cache'
+CACHE_VERSION = 1
+
+#{date format : {date string : epoch ns}} - files of one calendar share most
+#dates, so each string is only run through strptime once per process
+_date_memo = dict()
+
+
+def normalize_columns(columns):
+    '''
+    vendor headers to the package's column names, eg ' Volume' -> 'Volume'
+    and 'Close/Last' -> 'Close'. unknown headers are only stripped
+    '''
+    return [COLUMN_ALIASES.get(col.strip().lower(), col.strip())
+            for col in columns]
+
+
+def _parse_dates(strings, date_format=DATE_FORMAT):
+    '''
+    date strings to int64 epoch nanoseconds with a fixed format
+    '''
+    memo = _date_memo.setdefault(date_format, dict())
+    codes, uniques = pd.factorize(np.asarray(strings, dtype=object))
+    if (codes < 0).any():
+        raise ValueError('Missing dates')
+
+    new = [date for date in uniques if date not in memo]
+    if new:
+        parsed = pd.to_datetime(pd.Index(new), format=date_format) \
+                   .to_numpy(dtype='datetime64[ns]').view(np.int64)
+        memo.update(zip(new, parsed.tolist()))
+
+    return np.array([memo[date] for date in uniques], dtype=np.int64)[codes]
+
+
+def _header(path):
+    #first line of a file, or of a buffer which is rewound for the parser
+    if hasattr(path, 'read'):
+        line = path.readline()
+        path.seek(0)
+        return line.decode() if isinstance(line, bytes) else line
+
+    with open(path) as f:
+        return f.readline()
+
+
+def _parse(path, date_format=DATE_FORMAT, dtype='float64'):
+    '''
+    parse one vendor csv (path or buffer) into int64 epoch nanosecond dates
+    (ascending) and a dictionary of typed value arrays
+    '''
+    raw = _header(path).rstrip('\r\n').split(',')
+
+    names = normalize_columns(raw)
+    if 'Date' not in names:
+        raise ValueError(f'{path} has no Date column')
+
+    #explicit dtypes so the c parser never infers or falls back to objects
+    df = pd.read_csv(path, header=0, names=names, engine='c',
+                     dtype={name: (str if name == 'Date' else dtype)
+                            for name in names},
+                     skipinitialspace=True)
+
+    dates = _parse_dates(df['Date'], date_format)
+
+    #vendor files are newest first, a reverse is enough when already sorted
+    if len(dates) > 1 and (np.diff(dates) <= 0).all():
+        order = slice(None, None, -1)
+
+    else:
+        order = np.argsort(dates, kind='stable')
+
+    return dates[order], {name: df[name].to_numpy()[order] for name in names
+                          if name != 'Date'}
+
+
+def _to_frame(dates, values, price_col='Close'):
+    #copied out, so frames never hold views of cache files
+    df = pd.DataFrame(values, index=pd.DatetimeIndex(
+                        np.array(dates).view('datetime64[ns]'), name='Date'))
+
+    if price_col in df.columns and 'price' not in df.columns:
+        df['price'] = df[price_col]
+
+    return df
+
+
+def read_vendor_csv(path, date_format=DATE_FORMAT, dtype='float64',
+                    price_col='Close'):
+    '''
+    load a vendor csv such as spx_futures.csv - headers normalized, values
+    parsed with explicit dtypes, dates in ascending order
+
+    params
+    ======
+    path (str/file-like): csv with a Date column, eg a downloaded body in
+                          an io.BytesIO
+    date_format (str): strftime format of the Date column
+    dtype (str): 'float64' or 'float32' for the value columns
+    price_col (str): column copied to price, as the strategies expect
+
+    return
+    ======
+    pandas dataframe indexed by Date
+    '''
+    dates, values = _parse(path, date_format, dtype)
+    return _to_frame(dates, values, price_col)
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _read_cache(cache):
+    '''
+    manifest and {ticker: (dates, values)} of a cache, empty if there is none
+    '''
+    try:
+        with open(os.path.join(cache, 'manifest.json')) as f:
+            manifest = json.load(f)
+
+        if manifest.get('version') != CACHE_VERSION:
+            return None, dict()
+
+        offsets = np.load(os.path.join(cache, 'offsets.npy'))
+        dates = np.load(os.path.join(cache, 'dates.npy'), mmap_mode='r')
+        fields = {col: np.load(os.path.join(cache, f'{k}.npy'), mmap_mode='r')
+                  for k, col in enumerate(manifest['columns'])}
+
+    except (OSError, ValueError, KeyError):
+        return None, dict()
+
+    entries = dict()
+    for i, ticker in enumerate(manifest['tickers']):
+        start, end = offsets[i], offsets[i + 1]
+        entries[ticker] = (dates[start:end],
+                           {col: fields[col][start:end]
+                            for col in manifest['fields'][ticker]})
+
+    return manifest, entries
+
+
+def _save(path, arr):
+    #write then rename, so processes still mapping the old file keep it intact
+    with open(f'{path}.tmp', 'wb') as f:
+        np.save(f, arr)
+
+    os.replace(f'{path}.tmp', path)
+
+
+def _write_cache(cache, entries, files, date_format, dtype):
+    '''
+    store every ticker back to back - one dates array, one array per field
+    (nan where a ticker lacks it) and the offsets of each ticker
+    '''
+    os.makedirs(cache, exist_ok=True)
+
+    #no manifest while arrays are rewritten, so a crash part way through
+    #leaves a cache that is rebuilt rather than one with misaligned arrays
+    try:
+        os.remove(os.path.join(cache, 'manifest.json'))
+
+    except FileNotFoundError:
+        pass
+
+    #cached entries are views of the files about to be overwritten
+    entries = {ticker: (np.array(dates), {col: np.array(values)
+                                          for col, values in fields.items()})
+               for ticker, (dates, fields) in entries.items()}
+    tickers = sorted(entries)
+    columns = sorted({col for ticker in tickers for col in entries[ticker][1]})
+    lengths = [len(entries[ticker][0]) for ticker in tickers]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+    _save(os.path.join(cache, 'offsets.npy'), offsets)
+    _save(os.path.join(cache, 'dates.npy'), np.concatenate(
+                [entries[ticker][0] for ticker in tickers]).astype(np.int64)
+                if tickers else np.empty(0, dtype=np.int64))
+
+    for k, col in enumerate(columns):
+        block = np.full(offsets[-1], np.nan, dtype=dtype)
+        for ticker, start, end in zip(tickers, offsets[:-1], offsets[1:]):
+            if col in entries[ticker][1]:
+                block[start:end] = entries[ticker][1][col]
+
+        _save(os.path.join(cache, f'{k}.npy'), block)
+
+    #manifest last, it is what marks the arrays as current
+    manifest = {'version': CACHE_VERSION, 'date_format': date_format,
+                'dtype': dtype, 'tickers': tickers, 'columns': columns,
+                'fields': {ticker: list(entries[ticker][1])
+                           for ticker in tickers},
+                'files': files}
+    path = os.path.join(cache, 'manifest.json')
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(manifest, f)
+
+    os.replace(f'{path}.tmp', path)
+
+
+def load_directory(path, pattern='*.csv', cache=True, date_format=DATE_FORMAT,
+                   dtype='float64', price_col='Close', max_workers=None):
+    '''
+    load every vendor csv in a directory, one market per file named after
+    the file. files are parsed in parallel and kept in a columnar cache, so
+    reloading only parses files added or changed since
+
+    params
+    ======
+    path (str): directory of csv files
+    pattern (str): glob of files to load
+    cache (bool/str): cache directory, True for path/.ingest_cache, False to
+                      always parse
+    date_format (str): strftime format of the Date columns
+    dtype (str): 'float64' or 'float32' for the value columns
+    price_col (str): column copied to price
+    max_workers (int): parser processes, defaults to cpu count
+
+    return
+    ======
+    dictionary of {ticker : dataframe}
+    '''
+    paths = sorted(glob.glob(os.path.join(path, pattern)))
+    files = {os.path.splitext(os.path.basename(p))[0]: p for p in paths}
+    signatures = {ticker: _signature(p) for ticker, p in files.items()}
+
+    if cache is True:
+        cache = os.path.join(path, CACHE_DIR)
+
+    entries = dict()
+    if cache:
+        manifest, cached = _read_cache(cache)
+        if manifest is not None and manifest['date_format'] == date_format \
+                and manifest['dtype'] == dtype:
+            entries = {ticker: cached[ticker] for ticker in files
+                       if ticker in cached and
+                       manifest['files'].get(ticker) == signatures[ticker]}
+
+    stale = [ticker for ticker in files if ticker not in entries]
+    if stale:
+        parsed = dict()
+        if len(stale) == 1 or max_workers == 1:
+            for ticker in stale:
+                try:
+                    parsed[ticker] = _parse(files[ticker], date_format, dtype)
+
+                except Exception as err:
+                    print(f'Could not load {files[ticker]}: {err}')
+
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                futures = {ticker: pool.submit(_parse, files[ticker],
+                                               date_format, dtype)
+                           for ticker in stale}
+
+                for ticker, future in futures.items():
+                    try:
+                        parsed[ticker] = future.result()
+
+                    except Exception as err:
+                        #one bad file shouldn't sink the directory
+                        print(f'Could not load {files[ticker]}: {err}')
+
+        entries.update(parsed)
+        if cache and parsed:
+            _write_cache(cache, entries, {ticker: signatures[ticker]
+                                          for ticker in entries},
+                         date_format, dtype)
+
+    return {ticker: _to_frame(*entries[ticker], price_col)
+            for ticker in sorted(entries)}
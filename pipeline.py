@@ -0,0 +1,316 @@
+import numpy as np
+import pandas as pd
+from utils import ewma, RunningZScore
+from profiling import profiled
+
+
+class Scratch(object):
+    '''
+    reusable work buffers for pipeline strategies. buffers grow to the
+    longest series seen and are handed out as views, so running many markets
+    through one Scratch allocates intermediates once
+    '''
+
+    def __init__(self):
+        self._buffers = dict()
+
+    #getters
+    def get_nbytes(self):
+        return sum(buf.nbytes for buf in self._buffers.values())
+
+    def get(self, name, n, dtype=np.float64):
+        '''
+        buffer of length n under name, contents are left over from last use
+        '''
+        key = (name, np.dtype(dtype))
+        buf = self._buffers.get(key)
+        if buf is None or len(buf) < n:
+            buf = np.empty(n, dtype=dtype)
+            self._buffers[key] = buf
+
+        return buf[:n]
+
+    def clear(self):
+        self._buffers = dict()
+
+
+def rolling_mean(x, window, out, scratch):
+    '''
+    mean of the last window values written into out, nan until the window is
+    full or while it holds a nan - as Series.rolling(window).mean()
+
+    params
+    ======
+    x (np.ndarray): values, one per date
+    window (int): lookback
+    out (np.ndarray): buffer the same length as x
+    scratch (Scratch): work buffers
+
+    return
+    ======
+    out
+    '''
+    n = len(x)
+    total = scratch.get('rolling_total', n + 1)
+    missing = scratch.get('rolling_missing', n + 1, np.int64)
+    nan = np.isnan(x, out=scratch.get('rolling_nan', n, np.bool_))
+    filled = scratch.get('rolling_filled', n)
+    np.copyto(filled, x)
+    filled[nan] = 0.0
+
+    #running sums with a leading zero, so window sums are one subtraction
+    total[0] = 0.0
+    np.cumsum(filled, out=total[1:])
+    missing[0] = 0
+    np.cumsum(nan, out=missing[1:])
+
+    out[:window - 1] = np.nan
+    if window <= n:
+        np.subtract(total[window:], total[:n - window + 1], out=out[window - 1:])
+        out[window - 1:] /= window
+        out[window - 1:][missing[window:] != missing[:n - window + 1]] = np.nan
+
+    return out
+
+
+class PipelineStrategy(object):
+    '''
+    a strategy in pipeline mode declares the columns it reads (inputs) and
+    the intermediates it can hand back (diagnostics). compute works on arrays
+    in scratch buffers and returns the signal for every date plus the mask
+    of dates the frame based strategy keeps
+    '''
+
+    inputs = ()
+
+    def get_diagnostics(self):
+        return ()
+
+    def compute(self, data, scratch):
+        '''
+        params
+        ======
+        data (dict): {input name : float64 array}
+        scratch (Scratch): work buffers
+
+        return
+        ======
+        (signal as int8 array, mask of kept dates or None for all,
+         {diagnostic name : array})
+        '''
+        raise NotImplementedError
+
+
+class Breakout(PipelineStrategy):
+    '''
+    pipeline version of strategies.breakout
+    '''
+
+    inputs = ('price',)
+
+    def __init__(self, st=50, lt=200):
+        self._st = st
+        self._lt = lt
+
+    def get_diagnostics(self):
+        return (f'{self._st}_dma', f'{self._lt}_dma')
+
+    def compute(self, data, scratch):
+        price = data['price']
+        n = len(price)
+        fast = rolling_mean(price, self._st, scratch.get('fast', n), scratch)
+        slow = rolling_mean(price, self._lt, scratch.get('slow', n), scratch)
+
+        signal = scratch.get('signal', n, np.int8)
+        np.subtract(fast > slow, fast < slow, out=signal, dtype=np.int8)
+
+        keep = ~(np.isnan(price) | np.isnan(fast) | np.isnan(slow))
+        return signal, keep, dict(zip(self.get_diagnostics(), (fast, slow)))
+
+
+class MACD(PipelineStrategy):
+    '''
+    pipeline version of strategies.macd_strat
+    '''
+
+    inputs = ('price',)
+
+    def __init__(self, a=12, b=26, c=9):
+        self._a = a
+        self._b = b
+        self._c = c
+
+    def get_diagnostics(self):
+        return (f'ewm_{self._a}', f'ewm_{self._b}', 'macd_line', 'macd',
+                'macd_roll')
+
+    def compute(self, data, scratch):
+        price = data['price']
+        n = len(price)
+
+        fast = ewma(price, span=self._a)
+        slow = ewma(price, span=self._b)
+        line = np.subtract(fast, slow, out=scratch.get('macd_line', n))
+        macd = ewma(line, span=self._c)
+
+        #rate of change over 5 dates, as pct_change(periods=5)
+        roll = scratch.get('macd_roll', n)
+        roll[:5] = np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(macd[5:], macd[:-5], out=roll[5:])
+
+        roll -= 1
+
+        rising = roll >= 0
+        above = macd >= 0
+        signal = scratch.get('signal', n, np.int8)
+        np.subtract(rising & above, ~rising & ~above & ~np.isnan(roll),
+                    out=signal, dtype=np.int8)
+
+        keep = ~(np.isnan(price) | np.isnan(fast) | np.isnan(slow) |
+                 np.isnan(macd) | np.isnan(roll))
+        return signal, keep, dict(zip(self.get_diagnostics(),
+                                      (fast, slow, line, macd, roll)))
+
+
+class CrudeSMA(PipelineStrategy):
+    '''
+    pipeline version of crudetrader.strategy, every date is kept
+    '''
+
+    inputs = ('price',)
+
+    def __init__(self, fma=5, sma=30):
+        self._fma = fma
+        self._sma = sma
+
+    def get_diagnostics(self):
+        return (self._fma, self._sma, 'dist', 'dist_mean')
+
+    def compute(self, data, scratch):
+        price = data['price']
+        n = len(price)
+        fast = rolling_mean(price, self._fma, scratch.get('fast', n), scratch)
+        slow = rolling_mean(price, self._sma, scratch.get('slow', n), scratch)
+        dist = np.subtract(fast, slow, out=scratch.get('dist', n))
+        dist_mean = rolling_mean(dist, self._sma, scratch.get('dist_mean', n),
+                                 scratch)
+
+        signal = scratch.get('signal', n, np.int8)
+        signal[:] = -1
+        signal[(fast > slow) & (dist > dist_mean)] = 1
+
+        return signal, None, dict(zip(self.get_diagnostics(),
+                                      (fast, slow, dist, dist_mean)))
+
+
+class ZScore(PipelineStrategy):
+    '''
+    pipeline version of strategies.NaiveCounterTrend, every date is kept.
+    z-scores are point-in-time over an expanding history or rolling window
+    '''
+
+    def __init__(self, cols=('price',), buy_z=-2.0, sell_z=2.0, window=None):
+        self._cols = tuple(cols)
+        self._buy_z = buy_z
+        self._sell_z = sell_z
+        self._window = window
+        self.inputs = self._cols
+
+    def get_diagnostics(self):
+        return tuple(f'{col}_z_score' for col in self._cols)
+
+    def compute(self, data, scratch):
+        n = len(data[self._cols[0]])
+        net = scratch.get('net', n, np.int8)
+        net[:] = 0
+
+        #every column scored in one pass
+        values = scratch.get('z_input', n * len(self._cols)).reshape(n, -1)
+        for k, col in enumerate(self._cols):
+            values[:, k] = data[col]
+
+        scores = RunningZScore(self._window).batch(values)
+
+        diagnostics = dict()
+        for k, name in enumerate(self.get_diagnostics()):
+            z = scratch.get(name, n)
+            z[:] = scores[:, k]
+
+            net += z < self._buy_z
+            net -= z > self._sell_z
+            diagnostics[name] = z
+
+        return np.sign(net, out=net), None, diagnostics
+
+
+#strategy name (as in sweep.STRATEGIES) -> pipeline class
+PIPELINES = {
+    'breakout': Breakout,
+    'macd_strat': MACD,
+    'crude_sma': CrudeSMA,
+    'naive_counter_trend': ZScore,
+}
+
+
+@profiled('signal')
+def run(strategy, df, diagnostics=(), scratch=None):
+    '''
+    run a strategy in pipeline mode - the input frame is only read, and
+    nothing but the int8 signal and the requested diagnostics is allocated
+    per run
+
+    params
+    ======
+    strategy (PipelineStrategy): strategy to run
+    df (pd.DataFrame): frame holding the strategy's inputs
+    diagnostics (iterable): diagnostics or input columns to return alongside
+                            the signal, eg ('price', '50_dma')
+    scratch (Scratch): work buffers to reuse, a new one if not given
+
+    return
+    ======
+    pandas dataframe of the kept dates with signal and diagnostics
+    '''
+    missing = [col for col in strategy.inputs if col not in df.columns]
+    if missing:
+        raise ValueError(f'Missing input columns {missing}')
+
+    unknown = [name for name in diagnostics if name not in
+               strategy.get_diagnostics() and name not in df.columns]
+    if unknown:
+        raise ValueError(f'Unknown diagnostics {unknown}, available: '
+                         f'{list(strategy.get_diagnostics())}')
+
+    scratch = Scratch() if scratch is None else scratch
+    data = {col: df[col].to_numpy(dtype=np.float64) for col in strategy.inputs}
+    signal, keep, values = strategy.compute(data, scratch)
+
+    index = df.index if keep is None else df.index[keep]
+    columns = dict()
+    for name in diagnostics:
+        arr = values[name] if name in values else df[name].to_numpy()
+        #copies out of the scratch buffers, which the next run overwrites
+        columns[name] = arr.copy() if keep is None else arr[keep]
+
+    columns['signal'] = signal.copy() if keep is None else signal[keep]
+    return pd.DataFrame(columns, index=index)
+
+
+def run_markets(strategy, frames, diagnostics=(), scratch=None):
+    '''
+    run a strategy over many markets sharing one set of scratch buffers
+
+    params
+    ======
+    frames (dict): {market : dataframe}
+
+    see run for remaining params
+
+    return
+    ======
+    dictionary of {market : dataframe}
+    '''
+    scratch = Scratch() if scratch is None else scratch
+    return {market: run(strategy, df, diagnostics, scratch)
+            for market, df in frames.items()}
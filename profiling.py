@@ -0,0 +1,207 @@
+import json
+import time
+import functools
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+
+#tags (market, strategy, ...) applied to every stage recorded inside context()
+_tags = ContextVar('profiling_tags', default={})
+
+#shared do-nothing context handed out while profiling is off
+_NULL = nullcontext()
+
+
+class Profiler(object):
+    '''
+    records wall time, row counts and peak traced memory per pipeline stage.
+    off by default - while disabled, stage() and profiled functions cost one
+    attribute check
+
+    params
+    ======
+    enabled (bool): start recording immediately
+    memory (bool): track peak memory with tracemalloc (slows allocations)
+    '''
+
+    def __init__(self, enabled=False, memory=False):
+        self._enabled = False
+        self._memory = False
+        self._records = []
+
+        #running peak of each open stage, so nested stages don't lose it
+        self._peaks = []
+
+        if enabled:
+            self.enable(memory)
+
+    #getters
+    def get_enabled(self):
+        return self._enabled
+
+    def get_records(self):
+        return list(self._records)
+
+    #setters
+    def enable(self, memory=False):
+        self._enabled = True
+        self._memory = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self._enabled = False
+        if self._memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+        self._memory = False
+
+    def reset(self):
+        self._records = []
+
+    #worker functions
+    @contextmanager
+    def _record(self, stage, name, rows, tags):
+        record = {'stage': stage, 'name': name, **_tags.get(), **tags,
+                  'rows': rows}
+
+        if self._memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+
+            tracemalloc.reset_peak()
+            self._peaks.append(0)
+
+        start = time.perf_counter()
+        try:
+            yield record
+
+        finally:
+            record['seconds'] = time.perf_counter() - start
+
+            if self._memory:
+                _, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, self._peaks.pop())
+                record['peak_memory'] = max(peak - current, 0)
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+
+                tracemalloc.reset_peak()
+
+            self._records.append(record)
+
+    def stage(self, stage, name=None, rows=None, **tags):
+        '''
+        context manager timing the enclosed block. the yielded record can be
+        updated inside the block, eg record['rows'] = len(df)
+        '''
+        if not self._enabled:
+            return _NULL
+
+        return self._record(stage, name or stage, rows, tags)
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self._records)
+
+    def summary(self):
+        '''
+        total seconds, calls, rows and worst peak memory per stage and name
+        '''
+        df = self.to_frame()
+        if df.empty:
+            return df
+
+        agg = {'seconds': 'sum', 'rows': 'sum'}
+        if 'peak_memory' in df.columns:
+            agg['peak_memory'] = 'max'
+
+        grouped = df.groupby(['stage', 'name'])
+        ret = grouped.agg(agg)
+        ret['calls'] = grouped.size()
+        ret['rows_per_second'] = ret['rows'] / ret['seconds']
+        return ret.sort_values('seconds', ascending=False)
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self._records, f, indent=2, default=str)
+
+    def to_csv(self, path):
+        self.to_frame().to_csv(path, index=False)
+
+
+#one profiler per process, used by the decorators across the package
+_profiler = Profiler()
+
+
+def get_profiler():
+    return _profiler
+
+
+def enable(memory=False):
+    _profiler.enable(memory)
+
+
+def disable():
+    _profiler.disable()
+
+
+def stage(stage, name=None, rows=None, **tags):
+    '''
+    time a block as a stage of the process profiler, see Profiler.stage
+    '''
+    return _profiler.stage(stage, name, rows, **tags)
+
+
+def context(**tags):
+    '''
+    tag every stage recorded inside the block, eg market and strategy
+    '''
+    @contextmanager
+    def tagged():
+        token = _tags.set({**_tags.get(), **tags})
+        try:
+            yield
+
+        finally:
+            _tags.reset(token)
+
+    return tagged()
+
+
+def _rows(obj):
+    if isinstance(obj, (str, bytes)):
+        return None
+
+    try:
+        return len(obj)
+
+    except TypeError:
+        return None
+
+
+def profiled(stage_name):
+    '''
+    decorator recording each call of a function as a stage. rows are taken
+    from the first argument with a length (eg the input frame), or from the
+    result when no argument has one (eg a loader given a ticker)
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _profiler._enabled:
+                return func(*args, **kwargs)
+
+            rows = next((n for n in map(_rows, args) if n is not None), None)
+            with _profiler.stage(stage_name, func.__qualname__, rows) as record:
+                ret = func(*args, **kwargs)
+                if rows is None:
+                    record['rows'] = _rows(ret)
+
+                return ret
+
+        return wrapper
+
+    return decorator
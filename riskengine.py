@@ -1,10 +1,128 @@
 import numpy as np
 import pandas as pd
 import datetime as dt
-from utils import get_data
+from utils import align_frames
+from fetcher import fetch_universe
+from profiling import profiled
 
 
-def average_trading_range(df, periods=20):
+def true_range(high, low, close):
+    '''
+    true range of each bar over full history - max of high minus low and the
+    absolute distances of high/low from previous close. first bar has no
+    previous close so falls back to high minus low
+
+    params
+    ======
+    high (array-like): high prices, dates along last axis
+    low (array-like): low prices, same shape as high
+    close (array-like): close prices, same shape as high
+
+    return
+    ======
+    np.ndarray of true ranges, same shape as inputs
+    '''
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+
+    #previous close aligned to each bar, nothing to compare on first bar
+    prev_close = np.full_like(close, np.nan)
+    prev_close[..., 1:] = close[..., :-1]
+
+    #fmax skips nan so first bar (and bars after a gap) resolve to HML
+    return np.fmax(high - low, np.fmax(np.abs(high - prev_close),
+                                       np.abs(low - prev_close)))
+
+
+@profiled('sizing')
+def rolling_atr(high, low, close, periods=20, method='simple'):
+    '''
+    average true range for every date in one pass over the full history.
+    works on single series (dates,) or stacked markets (markets x dates)
+
+    params
+    ======
+    high (array-like): high prices, dates along last axis
+    low (array-like): low prices, same shape as high
+    close (array-like): close prices, same shape as high
+    periods (int): lookback period from which to calculate ATRs
+    method (str): 'simple' rolling mean or 'wilder' smoothing
+
+    return
+    ======
+    np.ndarray of ATR as of each date, nan until a full lookback is available
+    '''
+    if periods < 1:
+        raise ValueError(f'ATR lookback must be positive, got {periods}')
+
+    ranges = true_range(high, low, close)
+    atr = np.full_like(ranges, np.nan)
+    n = ranges.shape[-1]
+
+    if n < periods:
+        return atr
+
+    if method == 'simple':
+        #rolling sums from cumulative sums, missing bars counted separately so
+        #a gap only blanks the windows it falls in
+        valid = ~np.isnan(ranges)
+        sums = np.cumsum(np.where(valid, ranges, 0.0), axis=-1)
+        counts = np.cumsum(valid, axis=-1)
+
+        window_sums = sums[..., periods-1:].copy()
+        window_sums[..., 1:] -= sums[..., :-periods]
+        window_counts = counts[..., periods-1:].copy()
+        window_counts[..., 1:] -= counts[..., :-periods]
+
+        atr[..., periods-1:] = np.where(window_counts == periods,
+                                        window_sums / periods, np.nan)
+
+    elif method == 'wilder':
+        from scipy.signal import lfilter
+
+        #seed with simple average of first window then smooth recursively:
+        #atr_t = atr_t-1 + (tr_t - atr_t-1) / periods
+        alpha = 1.0 / periods
+        seed = ranges[..., :periods].mean(axis=-1)
+        atr[..., periods-1] = seed
+
+        if n > periods:
+            zi = ((1 - alpha) * seed)[..., np.newaxis]
+            atr[..., periods:], _ = lfilter([alpha], [1.0, alpha - 1.0],
+                                            ranges[..., periods:], axis=-1,
+                                            zi=zi)
+
+    else:
+        raise ValueError(f'Unknown ATR method {method}, use simple or wilder')
+
+    return atr
+
+
+def batch_atr(ohlc, periods=20, method='simple'):
+    '''
+    ATR over a stacked panel of markets in one call
+
+    params
+    ======
+    ohlc (np.ndarray): array of shape (markets, dates, 4) ordered open, high,
+                       low, close
+    periods (int): lookback period from which to calculate ATRs
+    method (str): 'simple' rolling mean or 'wilder' smoothing
+
+    return
+    ======
+    np.ndarray of shape (markets, dates) with per-date ATR for each market
+    '''
+    ohlc = np.asarray(ohlc, dtype=np.float64)
+    if ohlc.ndim != 3 or ohlc.shape[-1] != 4:
+        raise ValueError(f'Expected (markets, dates, 4) OHLC array, got {ohlc.shape}')
+
+    return rolling_atr(ohlc[..., 1], ohlc[..., 2], ohlc[..., 3], periods,
+                       method)
+
+
+def average_trading_range(df, periods=20, method='simple'):
     '''
     find average trading range of asset/security over lookback period
     Based on Perry Kaufman's 'Systems Trading and Methods'
@@ -13,35 +131,177 @@ def average_trading_range(df, periods=20):
     ======
     df (pd.Dataframe): dataframe object containing OHLC data for asset/security
     periods (int): lookback period from which to calculate ATRs
+    method (str): 'simple' rolling mean or 'wilder' smoothing
 
     return
     ======
     calculated average trading range for asset based on lookback period
     '''
-    #general average trading range implementation
+    #most recent value of the full history - see rolling_atr for every date
+    return rolling_atr(df['High'], df['Low'], df['Close'], periods, method)[-1]
+
+
+class EWMACovariance(object):
+    '''
+    exponentially weighted covariance of market returns, updated one date at a
+    time so the same object serves the full history and the live path.
+    returns are taken as zero mean (RiskMetrics style) and missing returns as
+    zero. estimates are shrunk toward a constant-correlation target
+
+    params
+    ======
+    n_markets (int): number of markets
+    span (float): span of the exponential decay, in dates
+    shrinkage (float): weight of the constant-correlation target, 0 to 1
+    '''
+
+    def __init__(self, n_markets, span=36, shrinkage=0.0):
+        if not 0 <= shrinkage <= 1:
+            raise ValueError(f'Shrinkage must be between 0 and 1, got {shrinkage}')
+
+        self._decay = 1 - 2 / (span + 1.0)
+        self._shrinkage = shrinkage
+
+        #decayed sum of outer products and of weights, same as EWMA(adjust)
+        self._num = np.zeros((n_markets, n_markets))
+        self._den = 0.0
+        self._nobs = np.zeros(n_markets, dtype=np.int64)
+
+    #getters
+    def get_nobs(self):
+        return self._nobs
+
+    def get_covariance(self):
+        '''
+        current shrunk covariance matrix (markets x markets)
+        '''
+        if self._den == 0:
+            return np.full_like(self._num, np.nan)
+
+        cov = self._num / self._den
+        if not self._shrinkage:
+            return cov
+
+        vol = np.sqrt(np.diag(cov))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = cov / np.outer(vol, vol)
+
+        live = vol > 0
+        n = live.sum()
+        if n < 2:
+            return cov
+
+        #average off-diagonal correlation of markets with any variance
+        live_corr = corr[np.ix_(live, live)]
+        avg_corr = (live_corr.sum() - n) / (n * (n - 1))
+
+        target = avg_corr * np.outer(vol, vol)
+        np.fill_diagonal(target, vol ** 2)
+        return (1 - self._shrinkage) * cov + self._shrinkage * target
+
+    def get_vol(self):
+        #shrinkage keeps the diagonal, so vols come straight from the estimate
+        if self._den == 0:
+            return np.full(len(self._nobs), np.nan)
+
+        return np.sqrt(np.diag(self._num) / self._den)
+
+    def portfolio_variance(self, weights):
+        '''
+        variance of a weighted book under the shrunk covariance, using only
+        matrix-vector products rather than building the shrunk matrix
+        '''
+        weights = np.asarray(weights, dtype=np.float64)
+        variance = weights @ self._num @ weights / self._den
+        if not self._shrinkage:
+            return variance
+
+        vol = self.get_vol()
+        live = vol > 0
+        n = live.sum()
+        if n < 2:
+            return variance
+
+        #sum of correlations is u' cov u with u the inverse vols
+        inv_vol = np.zeros_like(vol)
+        inv_vol[live] = 1 / vol[live]
+        avg_corr = (inv_vol @ self._num @ inv_vol / self._den - n) / (n * (n - 1))
+
+        risk = weights * vol
+        target = avg_corr * (risk.sum() ** 2 - (risk ** 2).sum()) + (risk ** 2).sum()
+        return (1 - self._shrinkage) * variance + self._shrinkage * target
+
+    #worker functions
+    def update(self, returns):
+        '''
+        add one date of returns (one per market, nan for missing)
+        '''
+        returns = np.asarray(returns, dtype=np.float64)
+        observed = ~np.isnan(returns)
+        returns = np.where(observed, returns, 0.0)
+
+        self._num *= self._decay
+        self._num += np.outer(returns, returns)
+        self._den = self._decay * self._den + 1.0
+        self._nobs += observed
+
+        return self
+
+
+@profiled('sizing')
+def vol_target_weights(returns, target=0.25, span=36, shrinkage=0.3,
+                       max_size=1.0, max_exposure=1.0, min_periods=20,
+                       periods_per_year=252):
+    '''
+    volatility targeted portfolio weights for every date. each market gets
+    risk in inverse proportion to its ewma vol, then the book is scaled so the
+    shrunk covariance puts portfolio vol on target. weights are capped at
+    max_size per market and max_exposure gross
+    Based on Rob Carver's 'Systematic Trading'
+
+    params
+    ======
+    returns (np.ndarray): (dates x markets) daily returns, nan for missing
+    target (float): annualized portfolio volatility target
+    span (float): ewma span of the covariance estimate
+    shrinkage (float): weight of constant-correlation target, 0 to 1
+    max_size (float): max absolute weight in any one market
+    max_exposure (float): max gross weight of the book
+    min_periods (int): returns a market needs before it is sized
+    periods_per_year (int): used to annualize
+
+    return
+    ======
+    np.ndarray of (dates x markets) weights as fractions of notional, sized
+    with data up to and including each date
+    '''
+    returns = np.asarray(returns, dtype=np.float64)
+    n_dates, n_markets = returns.shape
+    daily_target = target / np.sqrt(periods_per_year)
+
+    cov = EWMACovariance(n_markets, span, shrinkage)
+    weights = np.zeros((n_dates, n_markets))
 
-    #could be initiated as zeroes array and iteratively changed
-    ranges = list()
+    for i in range(n_dates):
+        vol = cov.update(returns[i]).get_vol()
 
-    #grab all applicable rows
-    data = df[-periods:]
+        live = (cov.get_nobs() >= min_periods) & (vol > 0)
+        if not live.any():
+            continue
 
-    #TODO: really need to look into a vectorized solution, iterrows is sloppy
-    for i, dat in data.iterrows():
-        #first day in period - use HML
-        if i == 0:
-            range = df.iloc[i]['High'] - df.iloc[i]['Low']
-            ranges.append(range)
+        raw = np.zeros(n_markets)
+        raw[live] = 1 / vol[live]
 
-        #find all applicable absolute levels, append max to running list
-        else:
-            day_range = df.iloc[i]['High'] - df.iloc[i]['Low']
-            high_close = abs(df.iloc[i]['High'] - df.iloc[i-1]['Close'])
-            low_close = abs(df.iloc[i]['Low'] - df.iloc[i-1]['Close'])
-            ranges.append(max(day_range, high_close, low_close))
+        port_vol = np.sqrt(cov.portfolio_variance(raw))
+        weights[i] = raw * (daily_target / port_vol)
 
-    #thinking of changing this to an int/float and taking val / periods instead
-    return np.average(ranges)
+    #per market cap, then scale whole book down to gross limit
+    weights = np.clip(weights, -max_size, max_size)
+    gross = np.abs(weights).sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(gross > max_exposure, max_exposure / gross, 1.0)
+
+    return weights * scale
 
 
 class RiskEngine(object):
@@ -58,12 +318,20 @@ class RiskEngine(object):
     end_date (datetime.date): datetime object representing end date for strategy
                             testing
     lookback (int): lookback period from which to derive allocation/sizing
+    store (datastore.MarketDataStore): local store to serve market data from
+    backend (object): fetcher backend, eg fetcher.HTTPBackend - defaults to
+                      the store, or the network when there is no store
+    concurrency (int): most markets fetched at once
+    colname (str): column used as each market's price, eg 'Close' for a
+                   store seeded from vendor csv files before Adj Close was
+                   written
     '''
 
     def __init__(self, notional_amount=100_000_000.00,
                 max_notional=100_000_000.00, max_exposure=1.0,
                 traded_markets=['CL=F','ES=F','CC=F','ZC=F','SB=F','NG=F'],
-                end=dt.date.today(), lookback=200):
+                end=dt.date.today(), lookback=200, store=None, backend=None,
+                concurrency=8, colname='Adj Close'):
 
         self.__notional = notional_amount
         self.__max_size = max_notional / notional_amount
@@ -72,9 +340,16 @@ class RiskEngine(object):
         self.__end = end
         self.__start = end - dt.timedelta(lookback)
 
-        #only variable that needs explanation: gets df for each market in list
-        self.__data = [get_data(market, self.get_start(),
-                       self.get_end()) for market in self.get_markets()]
+        #only variable that needs explanation: gets df for each market in list,
+        #fetched concurrently. markets that fail are left out of the engine
+        #and kept in errors
+        markets, self.__data, self.__errors = fetch_universe(
+            traded_markets, self.get_start(), self.get_end(), colname,
+            store=store, backend=backend, concurrency=concurrency)
+        self.__traded_markets = markets
+
+        #date-aligned (dates x markets) arrays, built from self.__data on demand
+        self.__panel = None
 
 
    #getters
@@ -93,6 +368,15 @@ class RiskEngine(object):
     def get_data(self):
         return self.__data
 
+    def get_errors(self):
+        return self.__errors
+
+    def get_panel(self):
+        if self.__panel is None:
+            self.__panel = align_frames(self.get_data(), self.get_markets())
+
+        return self.__panel
+
     def get_max_size(self):
         return self.__max_size
 
@@ -118,7 +402,7 @@ class RiskEngine(object):
     #TODO: need to add some more setters and organize neatly
 
 
-    def atr_parity(self, lookback_period):
+    def atr_parity(self, lookback_period, history=False):
         '''
         calculates position sizes based on asset atr over given time horizon.
         Based on Perry Kaufman's 'Trading Systems and Methods'
@@ -127,10 +411,16 @@ class RiskEngine(object):
         ======
         lookback_period (int): lookback period from which to to calculate atr
         position sizing
+        history (bool): return share counts for every date rather than only
+                        the latest
 
         return
         ======
+        {market: (shares, close)} for the last date, or a (dates x markets)
+        dataframe of shares if history
         '''
+        if history:
+            return self.atr_parity_history(lookback_period)
 
         #utility function to allocate capital based on ATR parity
         market_data = self.get_data()
@@ -146,8 +436,9 @@ class RiskEngine(object):
         #initial full exposure set at 0 - used to scale position size
         contract_exposure = 0
         for df, market in zip(market_data, markets):
-            #find unconstrained exposure for each market
-            atr = average_trading_range(df, lookback_period)
+            #find unconstrained exposure for each market, atr as of last date
+            atr = rolling_atr(df['High'], df['Low'], df['Close'],
+                              lookback_period)[-1]
             allocation_to_atr = allocation / atr
             #close price from market
             market_close = df.iloc[-1]['price']
@@ -175,7 +466,101 @@ class RiskEngine(object):
         return shares
 
 
-    def vol_targeting(self, target=0.25):
+    @profiled('sizing')
+    def atr_parity_history(self, lookback_period):
+        '''
+        atr parity share counts as of every date, using the atr and close
+        known on that date. same sizing as atr_parity - atr comes from each
+        market's own bars and is carried over dates it didn't trade, so the
+        last row matches atr_parity whatever the calendars. markets without a
+        full atr lookback get no position
+
+        params
+        ======
+        lookback_period (int): lookback period from which to to calculate atr
+
+        return
+        ======
+        pandas dataframe of (dates x markets) share counts
+        '''
+        panel = self.get_panel()
+        closes = panel['price']
+        dates = panel['dates']
+
+        #atr over each market's own bars - on the forward filled panel a
+        #closed market would repeat its last range on every holiday
+        atr = np.full_like(closes, np.nan)
+        for j, df in enumerate(self.get_data()):
+            if 'Date' in df.columns:
+                df = df.set_index('Date')
+
+            df = df[~df.index.duplicated(keep='last')].sort_index()
+            rows = dates.get_indexer(pd.to_datetime(df.index))
+            atr[rows, j] = rolling_atr(df['High'], df['Low'], df['Close'],
+                                       lookback_period)
+
+        #then carried over the dates a market didn't trade, as prices are
+        rows = np.arange(len(dates))[:, np.newaxis]
+        last_seen = np.maximum.accumulate(np.where(panel['mask'], rows, -1),
+                                          axis=0)
+        atr = np.where(last_seen >= 0,
+                       atr[np.maximum(last_seen, 0), np.arange(atr.shape[1])],
+                       np.nan)
+
+        #notional is full portfolio, max size is max tranche size as decimal
+        allocation = self.get_notional() * self.get_max_size()
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            allocation_to_atr = allocation / atr
+
+            #unconstrained $ exposure summed across markets for scaling
+            contract_exposure = np.nansum(closes * allocation_to_atr, axis=1,
+                                          keepdims=True)
+            scaler = allocation / contract_exposure
+
+            shares = np.round(np.nan_to_num(allocation_to_atr * scaler,
+                                            posinf=0.0, neginf=0.0))
+
+        return pd.DataFrame(shares, index=panel['dates'],
+                            columns=panel['markets'])
+
+
+    def position_pnl(self, shares, signals=None, lag=1, costs=None):
+        '''
+        dollar p&l of a (dates x markets) share count matrix, eg from
+        atr_parity(history=True), held against the aligned price panel
+
+        params
+        ======
+        shares (pd.DataFrame): share counts per date and market
+        signals (pd.DataFrame): optional direction per date and market, -1 to
+                                1 - defaults to long
+        lag (int): dates between sizing and the price change it earns
+        costs (dict/array-like): passed to backtest.portfolio_backtest
+
+        return
+        ======
+        dictionary from backtest.portfolio_backtest with pnl in dollars
+        '''
+        from backtest import portfolio_backtest
+
+        panel = self.get_panel()
+        price_changes = pd.DataFrame(np.diff(panel['price'], axis=0,
+                                             prepend=np.nan),
+                                     index=panel['dates'],
+                                     columns=panel['markets'])
+
+        if signals is None:
+            signals = pd.DataFrame(1.0, index=shares.index,
+                                   columns=shares.columns)
+
+        return portfolio_backtest(signals.reindex_like(price_changes),
+                                  price_changes, shares.reindex_like(price_changes),
+                                  lag, compound=False, costs=costs)
+
+
+    def vol_targeting(self, target=0.25, span=36, shrinkage=0.3,
+                      history=False):
         '''
         Position sizing of assets based on volatility
         Based on Rob Carver's 'Systematic Trading'
@@ -183,31 +568,38 @@ class RiskEngine(object):
         param
         =====
         target (float): annualized volatility target
+        span (float): ewma span of the covariance estimate
+        shrinkage (float): weight of constant-correlation covariance target
+        history (bool): return share counts for every date rather than only
+                        the latest
 
         return
         ======
-        position sizes of each asset
+        position sizes of each asset - {market: (shares, close)} for the last
+        date, or a (dates x markets) dataframe of shares if history
         '''
-        annual_cash_vol = target * self.get_notional()
-
-
-        market_data = self.get_data()
-        markets = self.get_markets()
-
-        #set up some dictionaries from which to set keep track of data
-        allocation_atrs = dict()
-        close_price = dict()
+        panel = self.get_panel()
+        prices = panel['price']
 
-        #notional is full portfolio, max size is max tranche size as decimal
-        allocation = self.get_notional() * self.get_max_size()
+        #daily log returns on the aligned calendar, first date has none
+        returns = np.full_like(prices, np.nan)
+        returns[1:] = np.log(prices[1:] / prices[:-1])
 
-        #initial full exposure set at 0 - used to scale position size
-        contract_exposure = 0
-        for df, market in zip(market_data, markets):
-            pass
+        weights = vol_target_weights(returns, target, span, shrinkage,
+                                     self.get_max_size(),
+                                     self.get_max_exposure())
 
+        #notional is full portfolio, weights are fractions of it
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shares = np.round(np.nan_to_num(weights * self.get_notional()
+                                            / prices))
 
+        if history:
+            return pd.DataFrame(shares, index=panel['dates'],
+                                columns=panel['markets'])
 
+        return {market: (shares[-1, j], prices[-1, j])
+                for j, market in enumerate(panel['markets'])}
 
 
 def main():
@@ -0,0 +1,336 @@
+import math
+import numpy as np
+import pandas as pd
+from bisect import bisect_left
+from statistics import NormalDist
+
+
+def _as_panel(data):
+    '''
+    2-D float array with dates down the rows, plus a function that wraps an
+    array of the same shape back into the caller's type
+    '''
+    arr = np.asarray(data, dtype=np.float64)
+    squeeze = arr.ndim == 1
+    arr = arr[:, np.newaxis] if squeeze else arr
+
+    def wrap(values, per_column=False):
+        if per_column:
+            values = values[0] if squeeze else values
+            if isinstance(data, pd.DataFrame):
+                return pd.Series(values, index=data.columns)
+
+            return values
+
+        values = values[:, 0] if squeeze else values
+        if isinstance(data, pd.DataFrame):
+            return pd.DataFrame(values, index=data.index, columns=data.columns)
+
+        if isinstance(data, pd.Series):
+            return pd.Series(values, index=data.index, name=data.name)
+
+        return values
+
+    return arr, wrap
+
+
+def _rolling_sum(arr, window):
+    #cumulative sum differences, windows holding any nan come back nan
+    out = np.full_like(arr, np.nan)
+    if len(arr) < window:
+        return out
+
+    valid = ~np.isnan(arr)
+    sums = np.cumsum(np.where(valid, arr, 0.0), axis=0)
+    counts = np.cumsum(valid, axis=0)
+
+    window_sums = sums[window-1:].copy()
+    window_sums[1:] -= sums[:-window]
+    window_counts = counts[window-1:].copy()
+    window_counts[1:] -= counts[:-window]
+
+    out[window-1:] = np.where(window_counts == window, window_sums, np.nan)
+    return out
+
+
+def to_returns(equity):
+    '''
+    simple returns of an equity curve panel, first date has none
+    '''
+    arr, wrap = _as_panel(equity)
+    ret = np.full_like(arr, np.nan)
+    ret[1:] = arr[1:] / arr[:-1] - 1
+    return wrap(ret)
+
+
+def rolling_var(returns, window=250, level=0.95, method='historical'):
+    '''
+    rolling value at risk of each column, as a positive loss
+
+    historical quantiles come from pandas' skiplist rolling quantile, so each
+    step is an O(log window) insert/remove rather than a re-sort
+
+    params
+    ======
+    returns (array-like/pd.DataFrame): (dates x columns) periodic returns
+    window (int): lookback in dates
+    level (float): confidence level, eg 0.95
+    method (str): 'historical' or 'parametric' (normal)
+
+    return
+    ======
+    rolling VaR, same shape and type as returns
+    '''
+    arr, wrap = _as_panel(returns)
+
+    if method == 'historical':
+        quantile = pd.DataFrame(arr).rolling(window).quantile(1 - level)
+        return wrap(-quantile.to_numpy())
+
+    if method == 'parametric':
+        mean, std = _rolling_moments(arr, window)
+        z = NormalDist().inv_cdf(level)
+        return wrap(z * std - mean)
+
+    raise ValueError(f'Unknown VaR method {method}, use historical or parametric')
+
+
+def _rolling_moments(arr, window):
+    mean = _rolling_sum(arr, window) / window
+    sq = _rolling_sum(arr ** 2, window) / window
+
+    #sample std, clipped since rounding can leave tiny negative variances
+    var = np.maximum(sq - mean ** 2, 0.0) * window / max(window - 1, 1)
+    return mean, np.sqrt(var)
+
+
+def _tail_sums(values, window, k, out):
+    '''
+    sum of the k smallest of each window of values into out, from window - 1
+    on. the window is kept sorted and each step evicts the oldest value and
+    inserts the newest, adjusting the tail sum by whatever crosses the k-th
+    place, so a step is two binary searches rather than a re-selection
+    '''
+    ordered = sorted(values[:window])
+    total = math.fsum(ordered[:k])
+    out[window - 1] = total
+
+    for i in range(window, len(values)):
+        old = values[i - window]
+        new = values[i]
+
+        #evicted from the tail, the k + 1-th smallest moves into it
+        pos = bisect_left(ordered, old)
+        if pos < k:
+            total += ordered[k] - old
+
+        del ordered[pos]
+
+        #inserted into the tail, the k-th smallest is pushed out of it
+        pos = bisect_left(ordered, new)
+        if pos < k:
+            total += new - ordered[k - 1]
+
+        ordered.insert(pos, new)
+
+        #resum once per lap so add/subtract rounding can't drift
+        if (i - window) % window == window - 1:
+            total = math.fsum(ordered[:k])
+
+        out[i] = total
+
+
+def rolling_es(returns, window=250, level=0.95, method='historical'):
+    '''
+    rolling expected shortfall (mean loss beyond VaR) of each column, as a
+    positive loss
+
+    historical shortfall averages the worst ceil(window * (1 - level))
+    returns of each window. the window is kept sorted as it slides, one value
+    evicted and one inserted per date, with a running sum of its tail
+
+    params
+    ======
+    returns (array-like/pd.DataFrame): (dates x columns) periodic returns
+    window (int): lookback in dates
+    level (float): confidence level, eg 0.95
+    method (str): 'historical' or 'parametric' (normal)
+
+    return
+    ======
+    rolling expected shortfall, same shape and type as returns
+    '''
+    arr, wrap = _as_panel(returns)
+
+    if method == 'parametric':
+        mean, std = _rolling_moments(arr, window)
+        dist = NormalDist()
+        tail = dist.pdf(dist.inv_cdf(level)) / (1 - level)
+        return wrap(tail * std - mean)
+
+    if method != 'historical':
+        raise ValueError(f'Unknown ES method {method}, use historical or parametric')
+
+    out = np.full_like(arr, np.nan)
+    n_dates, n_cols = arr.shape
+    if n_dates < window:
+        return wrap(out)
+
+    k = max(int(np.ceil(window * (1 - level))), 1)
+    missing = np.isnan(arr)
+    has_nan = _rolling_sum(missing.astype(np.float64), window) > 0
+
+    if k >= window:
+        #the tail is the whole window
+        out = -_rolling_sum(arr, window) / window
+
+    else:
+        #missing values stand in as zero, their windows are blanked below
+        filled = np.where(missing, 0.0, arr)
+        for j in range(n_cols):
+            sums = [math.nan] * n_dates
+            _tail_sums(filled[:, j].tolist(), window, k, sums)
+            out[:, j] = sums
+
+        out /= -k
+
+    out[has_nan] = np.nan
+    return wrap(out)
+
+
+def drawdowns(equity):
+    '''
+    drawdown path and duration of each equity curve
+
+    params
+    ======
+    equity (array-like/pd.DataFrame): (dates x columns) equity curves
+
+    return
+    ======
+    dictionary with 'drawdown' (fraction below running peak) and 'duration'
+    (dates since running peak) panels, plus per-column 'max_drawdown' and
+    'max_duration'
+    '''
+    arr, wrap = _as_panel(equity)
+    peak = np.fmax.accumulate(arr, axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdown = arr / peak - 1
+
+    #position of last date at a peak, carried forward
+    rows = np.arange(len(arr))[:, np.newaxis]
+    last_peak = np.maximum.accumulate(np.where(arr >= peak, rows, 0), axis=0)
+    duration = (rows - last_peak).astype(np.float64)
+
+    return {
+        'drawdown': wrap(drawdown),
+        'duration': wrap(duration),
+        'max_drawdown': wrap(np.nanmin(drawdown, axis=0, initial=0.0),
+                             per_column=True),
+        'max_duration': wrap(duration.max(axis=0, initial=0.0),
+                             per_column=True),
+    }
+
+
+def sharpe(returns, periods_per_year=252, risk_free=0.0):
+    '''
+    annualized sharpe ratio of each column of periodic returns
+    '''
+    arr, wrap = _as_panel(returns)
+    excess = arr - risk_free / periods_per_year
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.nanmean(excess, axis=0) / np.nanstd(excess, axis=0, ddof=1)
+
+    return wrap(ratio * np.sqrt(periods_per_year), per_column=True)
+
+
+def sortino(returns, periods_per_year=252, risk_free=0.0):
+    '''
+    annualized sortino ratio of each column - excess return over downside
+    deviation below zero
+    '''
+    arr, wrap = _as_panel(returns)
+    excess = arr - risk_free / periods_per_year
+    downside = np.sqrt(np.nanmean(np.minimum(excess, 0.0) ** 2, axis=0))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.nanmean(excess, axis=0) / downside
+
+    return wrap(ratio * np.sqrt(periods_per_year), per_column=True)
+
+
+def rolling_beta(returns, benchmark, window=60, min_periods=2):
+    '''
+    rolling beta of each column to a benchmark return series, eg the
+    spx_futures.csv series
+
+    params
+    ======
+    returns (array-like/pd.DataFrame): (dates x columns) periodic returns
+    benchmark (array-like/pd.Series): benchmark returns on the same dates
+    window (int): lookback in dates
+    min_periods (int): dates in the window where both sides printed needed
+                       for a beta
+
+    return
+    ======
+    rolling beta, same shape and type as returns
+    '''
+    arr, wrap = _as_panel(returns)
+    bench = np.asarray(benchmark, dtype=np.float64).reshape(-1, 1)
+    if len(bench) != len(arr):
+        raise ValueError(f'Benchmark has {len(bench)} dates, returns have {len(arr)}')
+
+    #only dates where both sides printed count toward each column's window,
+    #the rest are zeroed out of the sums and left out of the count
+    both = ~np.isnan(arr) & ~np.isnan(bench)
+    x = np.where(both, bench, 0.0)
+    y = np.where(both, arr, 0.0)
+    count = _rolling_sum(both.astype(np.float64), window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_x = _rolling_sum(x, window) / count
+        mean_y = _rolling_sum(y, window) / count
+        cov = _rolling_sum(x * y, window) / count - mean_x * mean_y
+        var = _rolling_sum(x ** 2, window) / count - mean_x ** 2
+
+        return wrap(np.where((var > 0) & (count >= min_periods), cov / var,
+                             np.nan))
+
+
+def summary(equity, level=0.95, periods_per_year=252):
+    '''
+    one row of risk metrics per equity curve, eg per sweep result
+
+    params
+    ======
+    equity (pd.DataFrame): (dates x results) equity curves
+    level (float): confidence level for full-sample VaR/ES
+    periods_per_year (int): used to annualize
+
+    return
+    ======
+    pandas dataframe indexed by equity column
+    '''
+    returns = to_returns(equity)
+    arr, _ = _as_panel(returns)
+    dd = drawdowns(equity)
+
+    #full sample historical var/es from one sort over all dates
+    arr = arr[1:]
+    n = (~np.isnan(arr)).sum(axis=0)
+    k = np.maximum(np.ceil(n * (1 - level)).astype(int), 1)
+    ordered = np.sort(np.where(np.isnan(arr), np.inf, arr), axis=0)
+    rows = np.arange(len(ordered))[:, np.newaxis]
+    tail = np.where(rows < k, ordered, 0.0)
+
+    return pd.DataFrame({
+        'sharpe': np.asarray(sharpe(returns, periods_per_year)),
+        'sortino': np.asarray(sortino(returns, periods_per_year)),
+        'var': -ordered[k - 1, np.arange(arr.shape[1])],
+        'es': -tail.sum(axis=0) / k,
+        'max_drawdown': np.asarray(dd['max_drawdown']),
+        'max_duration': np.asarray(dd['max_duration']),
+    }, index=getattr(equity, 'columns', None))
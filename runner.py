@@ -0,0 +1,244 @@
+'''
+headless batch runner - runs every (market, strategy, parameter set) in a
+config in parallel and writes results to parquet. plots are only drawn on
+request and go to png files through matplotlib's non-interactive backend
+
+usage
+=====
+python runner.py config.json [--output DIR] [--workers N] [--plot] [--profile]
+
+config (json, or yaml if PyYAML is installed)
+======
+{
+    "start": "2010-01-01",
+    "end": "2020-12-04",
+    "colname": "Close",
+    "store": "market_data",
+    "offline": false,
+    "csv": {"ES": "spx_futures.csv"},
+    "markets": ["ES"],
+    "strategies": [
+        {"name": "breakout", "params": {"st": 10, "lt": 30}},
+        {"name": "macd_strat", "grid": {"a": [8, 12], "b": [26], "c": [9]}},
+        {"name": "awesome_oscillator", "params": {"windows": [34, 50, 68]}},
+        {"name": "naive_counter_trend", "params": {"cols": ["price"]}},
+        {"name": "crude_sma", "params": {"fma": 5, "sma": 30}}
+    ]
+}
+'''
+import os
+
+#must be set before anything pulls in pyplot, workers inherit it
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import argparse
+import itertools
+import json
+import datetime as dt
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def load_config(path):
+    '''
+    read a run config from json (or yaml when PyYAML is available)
+    '''
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            return yaml.safe_load(f)
+
+        return json.load(f)
+
+
+def expand_jobs(config):
+    '''
+    one job per market, strategy and parameter set - a strategy's 'grid' is
+    expanded to every combination, 'params' is a single set
+    '''
+    jobs = []
+    for market in config['markets']:
+        for spec in config['strategies']:
+            if 'grid' in spec:
+                names = list(spec['grid'])
+                param_sets = [dict(zip(names, values)) for values in
+                              itertools.product(*spec['grid'].values())]
+
+            else:
+                param_sets = [spec.get('params', {})]
+
+            for params in param_sets:
+                jobs.append({'market': market, 'strategy': spec['name'],
+                             'params': params})
+
+    return jobs
+
+
+def _job_name(job, i):
+    market = job['market'].replace('=', '').replace('^', '').replace('/', '_')
+    return f"{market}_{job['strategy']}_{i}"
+
+
+def _plot(frame, path, title):
+    import matplotlib.pyplot as plt
+
+    buy_and_hold = frame['price'].apply(np.log).diff(1).cumsum().apply(np.exp)
+
+    fig, ax = plt.subplots(3, 1, figsize=(10, 8), sharex=True)
+    frame['cumulative_value'].plot(ax=ax[0], title=f'{title} Strategy Returns')
+    buy_and_hold.plot(ax=ax[1], title='Buy and Hold')
+    frame['signal'].plot(ax=ax[2], title='Long/Short')
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def run_job(job, config, output, name, plot=False, profile=False):
+    '''
+    run one strategy over one market and write its frame to parquet
+
+    return
+    ======
+    dictionary with the job, its performance metrics and output path, plus
+    the job's stage timings under 'profile' when profiling
+    '''
+    import profiling
+    from backtest import dollar_value
+    from datastore import MarketDataStore
+    from sweep import STRATEGIES, performance
+    from utils import get_data
+
+    profiler = profiling.get_profiler()
+    if profile:
+        profiler.reset()
+        profiler.enable(memory=True)
+
+    with profiling.context(market=job['market'], strategy=job['strategy'], job=name):
+        #data was refreshed up front, workers only read the local store
+        store = MarketDataStore(config.get('store', 'market_data'), offline=True)
+        df = get_data(job['market'], config['start'], config.get('end'),
+                      config.get('colname', 'Adj Close'), store).set_index('Date')
+
+        out = STRATEGIES[job['strategy']](df, **job['params'])
+
+        #same equity curve as the rest of the package, dollar_value is
+        #profiled as a pnl stage itself
+        out['daily_returns'] = out['price'].apply(np.log).diff(1)
+        out['cumulative_value'] = dollar_value(out)
+
+    path = os.path.join(output, f'{name}.parquet')
+    keep = [col for col in ('price', 'signal', 'daily_returns',
+                            'cumulative_value') if col in out.columns]
+    out[keep].to_parquet(path)
+
+    if plot:
+        _plot(out, os.path.join(output, f'{name}.png'),
+              f"{job['market']} {job['strategy']}")
+
+    ret = {'market': job['market'], 'strategy': job['strategy'],
+           'params': json.dumps(job['params']), 'path': path,
+           **performance(out['signal'].to_numpy(),
+                         out['daily_returns'].to_numpy())}
+
+    if profile:
+        ret['profile'] = profiler.get_records()
+        profiler.disable()
+
+    return ret
+
+
+def run(config, output='results', max_workers=None, plot=False, profile=False):
+    '''
+    run every job in a config in parallel
+
+    params
+    ======
+    config (dict): run config, see module docstring
+    output (str): directory for parquet (and png) output
+    max_workers (int): worker processes, defaults to cpu count
+    plot (bool): save a png per job
+    profile (bool): time every stage of every job, written to
+                    output/profile.json and output/profile.csv
+
+    return
+    ======
+    pandas dataframe summary, also written to output/summary.parquet
+    '''
+    from datastore import MarketDataStore
+
+    os.makedirs(output, exist_ok=True)
+    config.setdefault('end', str(dt.date.today()))
+
+    #seed and refresh the store once so workers never hit the network
+    store = MarketDataStore(config.get('store', 'market_data'),
+                            offline=config.get('offline', False))
+    for ticker, path in config.get('csv', {}).items():
+        store.seed_from_csv(ticker, path)
+
+    if not store.get_offline():
+        for market in config['markets']:
+            try:
+                store.update(market, config['start'], config['end'])
+
+            except Exception as err:
+                print(f'Could not refresh {market}: {err}')
+
+    jobs = expand_jobs(config)
+    rows = []
+    records = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(run_job, job, config, output,
+                               _job_name(job, i), plot, profile): job
+                   for i, job in enumerate(jobs)}
+
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                row = future.result()
+                records.extend(row.pop('profile', []))
+                rows.append(row)
+
+            except Exception as err:
+                #one bad market/strategy shouldn't sink the batch
+                rows.append({'market': job['market'], 'strategy': job['strategy'],
+                             'params': json.dumps(job['params']),
+                             'error': str(err)})
+
+    summary = pd.DataFrame(rows)
+    summary.to_parquet(os.path.join(output, 'summary.parquet'))
+
+    if profile:
+        with open(os.path.join(output, 'profile.json'), 'w') as f:
+            json.dump(records, f, indent=2, default=str)
+
+        pd.DataFrame(records).to_csv(os.path.join(output, 'profile.csv'),
+                                     index=False)
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless strategy batch runner')
+    parser.add_argument('config', help='path to json/yaml run config')
+    parser.add_argument('--output', default=None,
+                        help='output directory (default: config output or results)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: cpu count)')
+    parser.add_argument('--plot', action='store_true',
+                        help='save a png per job')
+    parser.add_argument('--profile', action='store_true',
+                        help='write per-stage timings and peak memory')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    output = args.output or config.get('output', 'results')
+    summary = run(config, output, args.workers or config.get('workers'),
+                  args.plot or config.get('plot', False),
+                  args.profile or config.get('profile', False))
+
+    print(f'{len(summary)} jobs written to {output}')
+
+
+if __name__ == '__main__':
+    main()
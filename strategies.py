@@ -2,10 +2,10 @@ import pandas as pd
 import datetime as dt
 from dateutil.relativedelta import relativedelta
 from backtest import dollar_value
-from utils import get_data, ZScorer
-import seaborn as sns
-import matplotlib.pyplot as plt
+from utils import get_data
+from indicators import rolling_mean, ewm_mean, median_price
 import numpy as np
+from profiling import profiled
 
 
 class BaseStrategy:
@@ -14,6 +14,8 @@ class BaseStrategy:
         self._dfs = dfs
         self._strategy_frames = []
         self._stop_loss = stop_loss
+        self._initial_set = 0.05
+        self._trailing_risk = 0.10
 
     #generic getters
     def get_dfs(self) -> list:
@@ -22,6 +24,14 @@ class BaseStrategy:
     def get_strategy_frames(self) -> list:
         return self._strategy_frames
 
+    def get_stop(self) -> dict:
+        #stop parameters passed to execution.simulate, zeros when stops are off
+        if not self._stop_loss:
+            return {'initial_set': 0.0, 'trailing_risk': 0.0}
+
+        return {'initial_set': self._initial_set,
+                'trailing_risk': self._trailing_risk}
+
     #generic setters
     def set_dfs(self, dfs: list):
         self._dfs = dfs
@@ -39,6 +49,18 @@ class BaseStrategy:
     #generic utility functions
     def set_stop(self, initial_set = 0.05, trailing_risk=0.10):
         '''
+        turn on stops for execute - an initial stop initial_set back from the
+        entry price, trailed trailing_risk back from the best price since
+        entry. the stop only ever moves in the position's favour, and after
+        being stopped out the strategy waits for its signal to change
+
+        params
+        ======
+        initial_set (float): fraction of entry price risked, 0 for none
+        trailing_risk (float): fraction of best price risked, 0 for none
+
+        notes
+        =====
         thinking about how this should work - do i want separate parameters
         or a singular dictionary representing the whole parameter set?
         using first explicitly and being able to unpack a payload seems like a
@@ -61,17 +83,38 @@ class BaseStrategy:
         getting too cute with the implementation and getting too into the timing
         aspect of things but think digging into this could be beneficial
         '''
-        pass
+        if initial_set < 0 or trailing_risk < 0:
+            raise ValueError('Stop distances must be non-negative')
+
+        self._stop_loss = True
+        self._initial_set = initial_set
+        self._trailing_risk = trailing_risk
+        return self
+
+    def execute(self, df, order_type='market', offset=0.0, commission=0.0):
+        '''
+        run a frame with a signal column through the event driven simulator
+        with this strategy's stops, see execution.simulate
+        '''
+        from execution import simulate
+
+        return simulate(df, 'signal', order_type, offset, commission=commission,
+                        **self.get_stop())
 
 
 
 class NaiveCounterTrend:
+    '''
+    counter-trend signals from point-in-time z-scores of cols - expanding
+    history by default, or a rolling window of window dates
+    '''
 
-    def __init__(self, df=None, cols=[], buy_z=-2.0, sell_z=2.0):
+    def __init__(self, df=None, cols=[], buy_z=-2.0, sell_z=2.0, window=None):
         self._df = df
         self._cols = cols
         self._buy_z = buy_z
         self._sell_z = sell_z
+        self._window = window
 
     #getters
     def get_df(self):
@@ -86,6 +129,9 @@ class NaiveCounterTrend:
     def get_sell_z(self):
         return self._sell_z
 
+    def get_window(self):
+        return self._window
+
     #setters
     def set_df(self, df):
         self._df = df
@@ -99,24 +145,39 @@ class NaiveCounterTrend:
     def set_sell_z(self, sell_z):
         self._sell_z = sell_z
 
+    def set_window(self, window):
+        self._window = window
+
     #worker functions
+    @profiled('signal')
     def generate_signals(self):
-        z_scaled_df = ZScorer.transform(self.get_df())
+        from transformers import ZScorer
+
+        #each date only sees history up to it, no lookahead
+        mode = 'expanding' if self.get_window() is None else 'rolling'
+        z_scaled_df = ZScorer(self.get_cols(), mode, self.get_window()) \
+                        .fit_transform(self.get_df())
 
+        net = 0
         for col in self.get_cols():
             #buy when below 2 deviations from mean and sell when above 2 deviations from mean
 
             #super simple, doing this for baseline testing
-            z_scaled_df[f'{col}_long_signal'] = np.where(z_scaled_df[col] < self.get_buy_z(),1,0)
-            z_scaled_df[f'{col}_short_signal'] = np.where(z_scaled_df[col] > self.get_sell_z(),1,0)
-
-        print(z_scaled_df)
+            z_col = z_scaled_df[f'{col}_z_score']
+            z_scaled_df[f'{col}_long_signal'] = np.where(z_col < self.get_buy_z(),1,0)
+            z_scaled_df[f'{col}_short_signal'] = np.where(z_col > self.get_sell_z(),1,0)
+            net = net + z_scaled_df[f'{col}_long_signal'] - \
+                    z_scaled_df[f'{col}_short_signal']
+
+        #long/short/flat across all columns
+        z_scaled_df['signal'] = np.sign(net)
         return z_scaled_df
 
 
+@profiled('signal')
 def breakout(df, st=50, lt=200):
-    df['{}_dma'.format(st)] = df[r'price'].rolling(st).mean()
-    df['{}_dma'.format(lt)] = df[r'price'].rolling(lt).mean()
+    df['{}_dma'.format(st)] = rolling_mean(df[r'price'], st)
+    df['{}_dma'.format(lt)] = rolling_mean(df[r'price'], lt)
 
     #eventually this could be better with using position size. 1 = 100% long,
     #-1 = 100% short. L/S parameters are vague right now, will use a position
@@ -136,13 +197,14 @@ def breakout(df, st=50, lt=200):
 
 
 def macd(df, a=12, b=26, c=9):
-    df[f'ewm_{a}'] = df['price'].ewm(span=a).mean()
-    df[f'ewm_{b}'] = df['price'].ewm(span=b).mean()
+    df[f'ewm_{a}'] = ewm_mean(df['price'], a)
+    df[f'ewm_{b}'] = ewm_mean(df['price'], b)
     df['macd_line'] = df[f'ewm_{a}'] - df[f'ewm_{b}']
-    return df['macd_line'].ewm(span=c).mean()
+    return ewm_mean(df['macd_line'], c)
 
 
-def macd_strat(df):
+@profiled('signal')
+def macd_strat(df, a=12, b=26, c=9):
     '''
     macd strategy in which acceleration/deceleration of divergence is captured
     in trades
@@ -150,6 +212,9 @@ def macd_strat(df):
     params
     ======
     df (pd.Dataframe): time-series price data for individual security
+    a (int): span of fast ewm
+    b (int): span of slow ewm
+    c (int): span of signal line ewm
 
     return
     ======
@@ -157,7 +222,7 @@ def macd_strat(df):
     generated from macd implementation
     '''
 
-    df['macd'] = macd(df)
+    df['macd'] = macd(df, a, b, c)
 
     ###########################################
     # looking for rate of change of macd here #
@@ -173,7 +238,6 @@ def macd_strat(df):
     #print(df['macd_roll'].dropna())
     df['signal_long'] = np.where(((df['macd_roll'] >= 0) & \
                                 (df['macd'] >= 0)), 1, 0)
-    print(df['signal_long'])
     df['signal_short'] = np.where((df['macd_roll'] < 0) & (df['macd'] < 0), 1, 0)
     df['signal_flat'] = np.where(((df['macd_roll'] >= 0) & (df['macd'] < 0)) | \
                             ((df['macd_roll'] < 0) & (df['macd'] >= 0)), 1, 0)
@@ -188,6 +252,8 @@ def macd_strat(df):
 
 
 def plot_macd(df):
+    import matplotlib.pyplot as plt
+
     buy_and_hold = df['price'].apply(np.log).diff(1).cumsum().apply(np.exp)
 
     fig, ax = plt.subplots(3,1)
@@ -198,6 +264,8 @@ def plot_macd(df):
 
 
 def plot_breakout(df, st, lt):
+    import matplotlib.pyplot as plt
+
     magnitude = df['{}_dma'.format(st)] - df['{}_dma'.format(lt)]
     buy_and_hold = df['price'].apply(np.log).diff(1).cumsum().apply(np.exp)
 
@@ -210,6 +278,16 @@ def plot_breakout(df, st, lt):
 
 
 
+def _row_nanmean(arr):
+    #mean of each row of a (dates, columns) array skipping nan, as
+    #DataFrame.mean(axis=1) does - all nan rows give nan, without warnings
+    valid = ~np.isnan(arr)
+    count = valid.sum(axis=1)
+    total = np.where(valid, arr, 0.0).sum(axis=1)
+    return np.divide(total, count, out=np.full(len(arr), np.nan),
+                     where=count > 0)
+
+
 class AwesomeOscillator(BaseStrategy):
 
 
@@ -242,17 +320,46 @@ class AwesomeOscillator(BaseStrategy):
         pandas dataframe containing dataframe with oscillator values
         '''
 
-        #pretty basic implementation here
-        df['med'] = (df['High'] + df['Low']) / 2
+        #pretty basic implementation here, median and its averages are cached
+        #so an ensemble of windows shares them
+        med = median_price(df['High'], df['Low'])
+        df['med'] = med
 
         #know that generic awesome oscillator will use 34-day window but want
         #to be able to play around with this. Ensemble of windows is interesting
-        df[f'awesome_oscillator_{window}_window'] = df['med'].rolling(5).mean()\
-                                            - df['med'].rolling(window).mean()
+        df[f'awesome_oscillator_{window}_window'] = rolling_mean(med, 5) \
+                                            - rolling_mean(med, window)
 
         return df
 
 
+    def awesome_oscillators(self, df, windows):
+        '''
+        oscillator of every window at once
+
+        params
+        ======
+        df (pd.DataFrame): pandas dataframe with High and Low columns
+        windows (list): lookback windows of the slow average
+
+        returns
+        =======
+        median price as an array of shape (dates,) and oscillators stacked
+        into an array of shape (dates, windows)
+        '''
+        #fast average and median are cached, so computed once for all windows
+        med = median_price(df['High'], df['Low'])
+        fast = rolling_mean(med, 5).to_numpy(dtype=np.float64)
+
+        osc = np.empty((len(df), len(windows)), dtype=np.float64)
+        for k, window in enumerate(windows):
+            np.subtract(fast, rolling_mean(med, window).to_numpy(dtype=np.float64),
+                        out=osc[:, k])
+
+        return med.to_numpy(dtype=np.float64), osc
+
+
+    @profiled('signal')
     def raw_awesome_oscillator_strategy(self, df, windows=[]):
         '''
         interpret and generate signals based on awesome oscillator raw signals
@@ -268,59 +375,56 @@ class AwesomeOscillator(BaseStrategy):
 
         params
         ======
-        df (pd.DataFrame): pandas dataframe with pricing data for security
-        window (int): list of lookback windows from which to generate signals
+        df (pd.DataFrame): pandas dataframe with pricing data for security,
+                           left unchanged
+        windows (list): list of lookback windows from which to generate signals
 
         returns
         =======
-        buy/sell signal expressed as a decimal
+        new dataframe of the rows with every window available, with the
+        oscillator, gradient and average columns and the signal
         '''
 
-        #generate awesome oscillator series' based on windows
-        for window in windows:
-            df = self.generate_awesome_oscillator(df, window)
-
-        #find columns independent of the windows used
-        oscillator_cols = [col for col in df.columns if 'awesome_oscillator' \
-                            in col]
-
-        #find if oscillator value is higher or lower than previous
-        for col in oscillator_cols:
-            df[f'gradient_{col}'] = df[col] - df[col].shift(1)
-
-        #find gradient columns independent of windows used
-        gradient_cols = [col for col in df.columns if 'gradient' in col]
+        windows = list(dict.fromkeys(windows))
+        osc_cols = [f'awesome_oscillator_{window}_window' for window in windows]
+        grad_cols = [f'gradient_{col}' for col in osc_cols]
 
-        #drop na values for sake of stopping errors
+        med, osc = self.awesome_oscillators(df, windows)
+        grad = np.full_like(osc, np.nan)
+        grad[1:] = osc[1:] - osc[:-1]
 
+        avg_oscillator = _row_nanmean(osc)
+        avg_gradient = pd.Series(_row_nanmean(grad)).rolling(5).mean().to_numpy()
 
-        #find averages over oscillator and gradient average values over earch window
-        df['avg_oscillator'] = df[oscillator_cols].apply(lambda x: x.mean(), axis=1)
-        df['avg_gradient'] = df[gradient_cols].apply(lambda x: x.mean(), \
-                                axis=1).rolling(5).mean()
+        #rows dropped where any input, window or average is missing
+        keep = (df.notna().all(axis=1).to_numpy() & ~np.isnan(med)
+                & ~np.isnan(grad).any(axis=1) & ~np.isnan(avg_oscillator)
+                & ~np.isnan(avg_gradient))
 
-        df.dropna(inplace=True)
+        avg_oscillator = avg_oscillator[keep]
+        avg_gradient = avg_gradient[keep]
 
         #generate signal based on the economic rationale explained above
-        df['signal_long'] = np.where((df['avg_oscillator'] > 0) & \
-                                    (df['avg_gradient'] > 0), 0, 1)
+        signal_long = np.where((avg_oscillator > 0) & (avg_gradient > 0), 0, 1)
+        signal_short = np.where((avg_oscillator < 0) & (avg_gradient < 0), 0, 1)
+        signal = np.select([signal_long == 1, signal_short == 1], [1, -1])
 
-        df['signal_short'] = np.where((df['avg_oscillator'] < 0) & \
-                                    (df['avg_gradient'] < 0), 0, 1)
+        columns = {'med': med[keep],
+                   **dict(zip(osc_cols, osc[keep].T)),
+                   **dict(zip(grad_cols, grad[keep].T)),
+                   'avg_oscillator': avg_oscillator,
+                   'avg_gradient': avg_gradient,
+                   'signal_long': signal_long,
+                   'signal_short': signal_short,
+                   'signal': signal}
 
-
-        conditions = [(df['signal_long'] == 1), (df['signal_short'] == 1)]
-        values = [1, -1]
-
-        df['signal'] = np.zeros(len(df['signal_long']))
-        df['signal'] = np.select(conditions, values)
-        return df
+        return df.loc[keep].assign(**columns)
 
 
     def run_strategy(self):
         ret = []
         for df in self.get_dfs():
-            strategy = self.awesome_oscillator_strategy(df, self.get_windows())
+            strategy = self.raw_awesome_oscillator_strategy(df, self.get_windows())
 
             strategy['daily_returns'] = strategy['price'].apply(np.log).diff(1)
             dollar_total = dollar_value(strategy)
@@ -334,6 +438,8 @@ class AwesomeOscillator(BaseStrategy):
 
 
     def plot_strategy(self):
+        import seaborn as sns
+        import matplotlib.pyplot as plt
 
         if len(self.get_dfs()) == 1:
             df = self.get_dfs()[0]
@@ -351,9 +457,6 @@ class AwesomeOscillator(BaseStrategy):
         plt.show()
 
 
-class
-
-
 def main():
 
     end_date = dt.date.today()
@@ -0,0 +1,216 @@
+import math
+import numpy as np
+import pandas as pd
+from utils import EWMA
+
+
+class RollingMean(object):
+    '''
+    simple moving average kept in a ring buffer, O(1) per update. matches
+    pandas rolling(window).mean() - nan until window values are seen and
+    while any nan is inside the window
+
+    params
+    ======
+    window (int): number of values averaged
+    '''
+
+    def __init__(self, window):
+        if window < 1:
+            raise ValueError(f'Rolling window must be positive, got {window}')
+
+        self._window = window
+        self._buf = [0.0] * window
+        self._pos = 0
+        self._seen = 0
+        self._nans = 0
+        self._sum = 0.0
+
+    def update(self, x):
+        old = self._buf[self._pos]
+        if self._seen >= self._window:
+            if math.isnan(old):
+                self._nans -= 1
+            else:
+                self._sum -= old
+
+        if math.isnan(x):
+            self._nans += 1
+        else:
+            self._sum += x
+
+        self._buf[self._pos] = x
+        self._pos = (self._pos + 1) % self._window
+        self._seen += 1
+
+        #resum once per lap so add/subtract rounding can't drift
+        if self._pos == 0:
+            self._sum = math.fsum(v for v in self._buf if not math.isnan(v))
+
+        if self._seen < self._window or self._nans:
+            return math.nan
+
+        return self._sum / self._window
+
+
+class StreamingStrategy(object):
+    '''
+    base for bar-by-bar strategies. update takes the newest bar (mapping with
+    price, High, Low) and returns the signal the batch function would give for
+    that bar, or None while the batch version would still be dropping rows
+    '''
+
+    def update(self, bar):
+        raise NotImplementedError
+
+    def replay(self, df):
+        '''
+        feed a full frame through bar by bar
+
+        params
+        ======
+        df (pd.DataFrame): time-series price data for individual security
+
+        return
+        ======
+        pandas series of signals for the rows a signal was emitted on - rows
+        with any missing field are left out, as the batch dropna does
+        '''
+        signals = dict()
+        for idx, bar in zip(df.index, df.to_dict('records')):
+            signal = self.update(bar)
+            if signal is not None and not any(pd.isna(v) for v in bar.values()):
+                signals[idx] = signal
+
+        ret = pd.Series(signals, name='signal', dtype=np.int64)
+        ret.index.name = df.index.name
+        return ret
+
+
+class StreamingBreakout(StreamingStrategy):
+    '''
+    bar-by-bar version of strategies.breakout
+
+    params
+    ======
+    st (int): short moving average window
+    lt (int): long moving average window
+    '''
+
+    def __init__(self, st=50, lt=200):
+        self._st = RollingMean(st)
+        self._lt = RollingMean(lt)
+
+    def update(self, bar):
+        price = float(bar['price'])
+        short = self._st.update(price)
+        long = self._lt.update(price)
+
+        if math.isnan(short) or math.isnan(long):
+            return None
+
+        if short > long:
+            return 1
+
+        return -1 if short < long else 0
+
+
+class StreamingMACD(StreamingStrategy):
+    '''
+    bar-by-bar version of strategies.macd_strat, keeps running ewm state for
+    the three averages and the last few macd values for the rate of change
+
+    params
+    ======
+    a (int): span of fast ewm
+    b (int): span of slow ewm
+    c (int): span of signal line ewm
+    roc (int): periods over which macd rate of change is measured
+    '''
+
+    def __init__(self, a=12, b=26, c=9, roc=5):
+        self._fast = EWMA(span=a)
+        self._slow = EWMA(span=b)
+        self._signal_line = EWMA(span=c)
+        self._roc = roc
+        self._history = [math.nan] * (roc + 1)
+        self._pos = 0
+
+    def update(self, bar):
+        price = float(bar['price'])
+        line = float(self._fast.update(price)) - float(self._slow.update(price))
+        value = float(self._signal_line.update(line))
+
+        #ring of last roc + 1 macd values, slot at pos is roc bars back
+        self._history[self._pos] = value
+        self._pos = (self._pos + 1) % (self._roc + 1)
+        prior = self._history[self._pos]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            roll = float(np.float64(value) / np.float64(prior) - 1)
+
+        if math.isnan(roll) or math.isnan(value):
+            return None
+
+        if roll >= 0 and value >= 0:
+            return 1
+
+        if roll < 0 and value < 0:
+            return -1
+
+        return 0
+
+
+class StreamingAwesomeOscillator(StreamingStrategy):
+    '''
+    bar-by-bar version of AwesomeOscillator.raw_awesome_oscillator_strategy
+    over an ensemble of windows
+
+    params
+    ======
+    windows (list): lookback windows of the oscillator
+    '''
+
+    def __init__(self, windows=[34]):
+        self._windows = list(windows)
+        self._fast = RollingMean(5)
+        self._slows = [RollingMean(window) for window in self._windows]
+        self._prev = [math.nan] * len(self._windows)
+        self._gradient = RollingMean(5)
+
+    #getters
+    def get_windows(self):
+        return self._windows
+
+    def get_oscillators(self):
+        #oscillator of each window as of the last update
+        return list(self._prev)
+
+    @staticmethod
+    def _mean(values):
+        #row mean skipping nan, like DataFrame.mean(axis=1)
+        valid = [v for v in values if not math.isnan(v)]
+        return sum(valid) / len(valid) if valid else math.nan
+
+    def update(self, bar):
+        med = (float(bar['High']) + float(bar['Low'])) / 2
+        fast = self._fast.update(med)
+
+        oscillators = [fast - slow.update(med) for slow in self._slows]
+        gradients = [osc - prev for osc, prev in zip(oscillators, self._prev)]
+        self._prev = oscillators
+
+        oscillator = self._mean(oscillators)
+        gradient = self._gradient.update(self._mean(gradients))
+
+        #batch version drops rows until every window has a gradient
+        if any(math.isnan(v) for v in gradients) or math.isnan(gradient):
+            return None
+
+        if not (oscillator > 0 and gradient > 0):
+            return 1
+
+        if not (oscillator < 0 and gradient < 0):
+            return -1
+
+        return 0
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from riskengine import EWMACovariance
+
+
+#per-worker simulation inputs, set once by _setup rather than sent per task
+_state = dict()
+
+
+def _setup(returns, exposure, notional, method, block, cov_factor, horizon):
+    _state.update(returns=returns, exposure=exposure, notional=notional,
+                  method=method, block=block, cov_factor=cov_factor,
+                  horizon=horizon)
+
+
+def _cov_factor(returns, span=36):
+    '''
+    matrix square root of the latest ewma covariance, falls back to an
+    eigen decomposition when the estimate isn't positive definite
+    '''
+    cov = EWMACovariance(returns.shape[1], span)
+    for row in returns:
+        cov.update(row)
+
+    sigma = cov.get_covariance()
+    try:
+        return np.linalg.cholesky(sigma)
+
+    except np.linalg.LinAlgError:
+        vals, vecs = np.linalg.eigh(sigma)
+        return vecs * np.sqrt(np.clip(vals, 0.0, None))
+
+
+def _simulate(task):
+    '''
+    simulate one chunk of paths, returns its p&l and worst gross exposure
+    '''
+    n_paths, seed = task
+    rng = np.random.default_rng(seed)
+    returns = _state['returns']
+    horizon = _state['horizon']
+    n_markets = returns.shape[1]
+
+    if _state['method'] == 'bootstrap':
+        #consecutive blocks of history keep autocorrelation and co-movement
+        block = min(_state['block'], len(returns))
+        n_blocks = -(-horizon // block)
+        starts = rng.integers(0, len(returns) - block + 1, (n_paths, n_blocks))
+        rows = (starts[..., np.newaxis] + np.arange(block)).reshape(n_paths, -1)
+        paths = returns[rows[:, :horizon]]
+
+    else:
+        shocks = rng.standard_normal((n_paths, horizon, n_markets))
+        paths = shocks @ _state['cov_factor'].T
+
+    #value of each position along the path, relative to today
+    growth = np.exp(np.cumsum(paths, axis=1))
+    exposure = _state['exposure']
+    pnl = (growth[:, -1, :] - 1) @ exposure
+    gross = (growth * np.abs(exposure)).sum(axis=2).max(axis=1) / _state['notional']
+
+    return pnl, gross
+
+
+def stress_test(engine, lookback_period=20, positions=None, n_paths=100_000,
+                horizon=10, method='bootstrap', block=5, span=36,
+                chunk_size=10_000, max_workers=None, seed=None, level=0.99):
+    '''
+    simulate p&l of the engine's positions over a horizon, either by block
+    bootstrapping historical returns or from an ewma covariance monte carlo.
+    paths are drawn in chunks of bounded size on a process pool, each chunk
+    with its own spawned seed so results reproduce for any worker count
+
+    params
+    ======
+    engine (RiskEngine): engine whose markets and history are stressed
+    lookback_period (int): atr lookback used to size positions
+    positions (dict): {market: (shares, close)}, defaults to atr_parity
+    n_paths (int): number of simulated paths
+    horizon (int): dates per path
+    method (str): 'bootstrap' or 'montecarlo'
+    block (int): bootstrap block length in dates
+    span (float): ewma span of the monte carlo covariance
+    chunk_size (int): paths simulated at once per task
+    max_workers (int): worker processes, defaults to cpu count
+    seed (int): seed for reproducible paths
+    level (float): confidence level for tail loss
+
+    return
+    ======
+    dictionary with simulated 'pnl' and 'max_gross_exposure' per path,
+    'var' and 'es' tail losses, 'breach_probability' of going over
+    max_exposure at any point, and a 'summary' frame of p&l quantiles
+    '''
+    if method not in ('bootstrap', 'montecarlo'):
+        raise ValueError(f'Unknown stress method {method}, use bootstrap or montecarlo')
+
+    if positions is None:
+        positions = engine.atr_parity(lookback_period)
+
+    panel = engine.get_panel()
+    prices = panel['price']
+    markets = panel['markets']
+
+    #log returns of the history, missing dates move nothing
+    returns = np.nan_to_num(np.diff(np.log(prices), axis=0))
+    exposure = np.array([positions[market][0] * positions[market][1]
+                         for market in markets], dtype=np.float64)
+
+    cov_factor = _cov_factor(returns, span) if method == 'montecarlo' else None
+
+    sizes = [min(chunk_size, n_paths - start)
+             for start in range(0, n_paths, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    initargs = (returns, exposure, engine.get_notional(), method, block,
+                cov_factor, horizon)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_setup,
+                             initargs=initargs) as pool:
+        results = list(pool.map(_simulate, zip(sizes, seeds)))
+
+    pnl = np.concatenate([chunk[0] for chunk in results])
+    gross = np.concatenate([chunk[1] for chunk in results])
+
+    var = -np.quantile(pnl, 1 - level)
+    tail = pnl[pnl <= -var]
+
+    quantiles = [0.001, 0.01, 0.05, 0.5, 0.95, 0.99, 0.999]
+    return {
+        'pnl': pnl,
+        'max_gross_exposure': gross,
+        'var': var,
+        'es': -tail.mean() if len(tail) else var,
+        'breach_probability': (gross > engine.get_max_exposure()).mean(),
+        'summary': pd.DataFrame({'pnl': np.quantile(pnl, quantiles),
+                                 'max_gross_exposure': np.quantile(gross, quantiles)},
+                                index=pd.Index(quantiles, name='quantile')),
+    }
@@ -0,0 +1,232 @@
+import itertools
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+
+#fields shipped to workers, anything a market doesn't have is left as nan
+FIELDS = ('price', 'High', 'Low', 'Close', 'Volume')
+
+#per-worker views onto the shared price block, set by _attach
+_shared = dict()
+
+
+def _breakout(df, st=50, lt=200):
+    from strategies import breakout
+    return breakout(df, st, lt)
+
+def _macd(df, a=12, b=26, c=9):
+    from strategies import macd_strat
+    return macd_strat(df, a, b, c)
+
+def _awesome(df, windows=(34,)):
+    from strategies import AwesomeOscillator
+    return AwesomeOscillator([], list(windows)).raw_awesome_oscillator_strategy(
+                df, list(windows))
+
+def _counter_trend(df, cols=('price',), buy_z=-2.0, sell_z=2.0, window=None):
+    from strategies import NaiveCounterTrend
+    return NaiveCounterTrend(df, list(cols), buy_z, sell_z,
+                             window).generate_signals()
+
+def _crude(df, fma=5, sma=30):
+    from crudetrader import strategy
+    return strategy(df, fma, sma).rename(columns={'position': 'signal'})
+
+
+#strategy name -> function taking (df, **params), returning frame with signal
+STRATEGIES = {
+    'breakout': _breakout,
+    'macd_strat': _macd,
+    'awesome_oscillator': _awesome,
+    'naive_counter_trend': _counter_trend,
+    'crude_sma': _crude,
+}
+
+
+def performance(signal, log_returns, periods_per_year=252):
+    '''
+    summary statistics of a signal applied to log returns, yesterday's signal
+    earns today's return as in backtest.dollar_value
+
+    params
+    ======
+    signal (array-like): position for each date, -1 to 1
+    log_returns (array-like): log return for each date
+    periods_per_year (int): used to annualize
+
+    return
+    ======
+    dictionary of metrics
+    '''
+    signal = np.asarray(signal, dtype=np.float64)
+    log_returns = np.asarray(log_returns, dtype=np.float64)
+
+    held = np.empty_like(signal)
+    held[0] = np.nan
+    held[1:] = signal[:-1]
+    strat = np.nan_to_num(held * log_returns)
+
+    equity = np.cumsum(strat)
+    drawdown = equity - np.maximum.accumulate(np.maximum(equity, 0.0))
+    vol = strat.std()
+    n = len(strat)
+
+    return {
+        'total_return': np.expm1(equity[-1]) if n else np.nan,
+        'annual_return': strat.mean() * periods_per_year if n else np.nan,
+        'annual_vol': vol * np.sqrt(periods_per_year) if n else np.nan,
+        'sharpe': strat.mean() / vol * np.sqrt(periods_per_year) if vol > 0
+                    else np.nan,
+        'max_drawdown': np.expm1(drawdown.min()) if n else np.nan,
+        'turnover': np.abs(np.diff(signal)).mean() if n > 1 else 0.0,
+        'n_bars': n,
+    }
+
+
+def _share(data):
+    '''
+    pack per-market frames into one shared memory block of shape
+    (total rows, fields) plus the row offsets of each market
+    '''
+    lengths = [len(df) for df in data.values()]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+    shm = shared_memory.SharedMemory(create=True,
+                                     size=max(offsets[-1], 1) * len(FIELDS) * 8)
+    block = np.ndarray((offsets[-1], len(FIELDS)), dtype=np.float64,
+                       buffer=shm.buf)
+    block[:] = np.nan
+
+    for (start, end), df in zip(zip(offsets[:-1], offsets[1:]), data.values()):
+        for k, field in enumerate(FIELDS):
+            if field in df.columns:
+                block[start:end, k] = df[field].to_numpy(dtype=np.float64)
+
+    return shm, offsets
+
+
+def _attach(name, n_rows):
+    #runs once per worker, keeps the segment open for the life of the process
+    shm = shared_memory.SharedMemory(name=name)
+    _shared['shm'] = shm
+    _shared['block'] = np.ndarray((n_rows, len(FIELDS)), dtype=np.float64,
+                                  buffer=shm.buf)
+
+
+def _evaluate(task):
+    '''
+    run one strategy over one market for a batch of parameter sets
+    '''
+    strategy, market, start, end, param_sets, periods_per_year = task
+    func = STRATEGIES.get(strategy, strategy)
+    block = _shared['block'][start:end]
+
+    rows = []
+    for params in param_sets:
+        #fresh frame per run since strategies add columns to their input
+        df = pd.DataFrame(block, columns=FIELDS).dropna(axis=1, how='all')
+        row = {'market': market, **params}
+
+        try:
+            out = func(df, **params)
+            log_returns = np.log(out['price']).diff().to_numpy()
+            row.update(performance(out['signal'].to_numpy(), log_returns,
+                                   periods_per_year))
+
+        except Exception as err:
+            row['error'] = str(err)
+
+        rows.append(row)
+
+    return rows
+
+
+def _run(data, strategy, param_sets, max_workers=None, batch_size=64,
+         periods_per_year=252):
+    shm, offsets = _share(data)
+
+    try:
+        tasks = []
+        for i, market in enumerate(data):
+            for k in range(0, len(param_sets), batch_size):
+                tasks.append((strategy, market, offsets[i], offsets[i+1],
+                              param_sets[k:k+batch_size], periods_per_year))
+
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_attach,
+                                 initargs=(shm.name, offsets[-1])) as pool:
+            results = list(pool.map(_evaluate, tasks))
+
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return pd.DataFrame([row for rows in results for row in rows])
+
+
+def grid_search(data, strategy, grid, where=None, max_workers=None,
+                batch_size=64, periods_per_year=252):
+    '''
+    evaluate every combination of parameters for a strategy across markets
+    in parallel. price data is placed in shared memory once rather than
+    pickled with every task
+
+    params
+    ======
+    data (dict): {market : dataframe} with price (and High/Low for awesome)
+    strategy (str/func): key of STRATEGIES or picklable function of form
+                         func(df, **params) returning frame with signal
+    grid (dict): {param name : list of values}
+    where (func): optional filter on a parameter dict, eg st < lt
+    max_workers (int): worker processes, defaults to cpu count
+    batch_size (int): parameter sets evaluated per task
+    periods_per_year (int): used to annualize
+
+    return
+    ======
+    pandas dataframe with one row per market and parameter set
+    '''
+    names = list(grid)
+    param_sets = [dict(zip(names, values))
+                  for values in itertools.product(*grid.values())]
+
+    if where is not None:
+        param_sets = [params for params in param_sets if where(params)]
+
+    return _run(data, strategy, param_sets, max_workers, batch_size,
+                periods_per_year)
+
+
+def random_search(data, strategy, space, n_iter=100, seed=None, where=None,
+                  max_workers=None, batch_size=64, periods_per_year=252):
+    '''
+    evaluate randomly drawn parameter sets for a strategy across markets
+
+    params
+    ======
+    space (dict): {param name : list of choices or (low, high) integer range}
+    n_iter (int): number of parameter sets to draw
+    seed (int): seed for reproducible draws
+
+    see grid_search for remaining params and return
+    '''
+    rng = np.random.default_rng(seed)
+    param_sets = []
+    attempts = 0
+
+    while len(param_sets) < n_iter and attempts < n_iter * 100:
+        attempts += 1
+        params = dict()
+        for name, choices in space.items():
+            if isinstance(choices, tuple) and len(choices) == 2:
+                params[name] = int(rng.integers(choices[0], choices[1] + 1))
+
+            else:
+                params[name] = choices[rng.integers(len(choices))]
+
+        if where is None or where(params):
+            param_sets.append(params)
+
+    return _run(data, strategy, param_sets, max_workers, batch_size,
+                periods_per_year)
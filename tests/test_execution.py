@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+from execution import simulate, MARKET_FILL, LIMIT_FILL, NO_EVENT
+
+
+def bars(close, low=None, signal=None):
+    close = np.asarray(close, dtype=np.float64)
+    return pd.DataFrame({'Open': close,
+                         'High': close + 0.5,
+                         'Low': close - 0.5 if low is None else low,
+                         'Close': close,
+                         'signal': 1.0 if signal is None else signal})
+
+
+@pytest.fixture(scope='module')
+def walk():
+    rng = np.random.default_rng(0)
+    n = 5_000
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    spread = close * rng.uniform(0, 0.01, n)
+    df = pd.DataFrame({'Open': close - spread * rng.uniform(-1, 1, n),
+                       'High': close + spread, 'Low': close - spread,
+                       'Close': close})
+    df['signal'] = np.sign(df['Close'] - df['Close'].rolling(20).mean())
+    return df
+
+
+def test_market_order_fills_next_open():
+    out = simulate(bars([100, 101, 102]))
+    assert out['event'].tolist() == [NO_EVENT, MARKET_FILL, NO_EVENT]
+    assert out['fill_price'].iloc[1] == 101
+    assert out['position'].tolist() == [0, 1, 1]
+
+
+def test_resting_limit_order_keeps_its_price():
+    #priced at 99 off the first close, the rally after mustn't move it up
+    close = [100, 102, 104, 106, 100]
+    low = [99.5, 101.5, 103.5, 105.5, 98.5]
+    out = simulate(bars(close, low), order_type='limit', offset=0.01)
+
+    assert out['event'].tolist()[:4] == [NO_EVENT] * 4
+    assert out['event'].iloc[4] == LIMIT_FILL
+    assert out['fill_price'].iloc[4] == pytest.approx(99.0)
+
+
+def test_new_target_reprices_order():
+    close = [100, 102, 104, 106]
+    low = [99.5, 101.5, 103.5, 102.5]
+    signal = [1.0, -1.0, 1.0, 1.0]
+    out = simulate(bars(close, low, signal), order_type='limit', offset=0.01)
+
+    #long order re-placed off the third close, 104 * 0.99
+    assert out['event'].iloc[3] == LIMIT_FILL
+    assert out['fill_price'].iloc[3] == pytest.approx(104 * 0.99)
+
+
+@pytest.mark.parametrize('order_type', ['market', 'limit', 'stop'])
+def test_numba_kernel_matches_python(walk, order_type):
+    pytest.importorskip('numba')
+    kwargs = dict(order_type=order_type, offset=0.002, initial_set=0.02,
+                  trailing_risk=0.03, commission=0.0001)
+
+    compiled = simulate(walk, engine='numba', **kwargs)
+    python = simulate(walk, engine='python', **kwargs)
+    pd.testing.assert_frame_equal(compiled, python, rtol=1e-12)
@@ -0,0 +1,62 @@
+import os
+import math
+import numpy as np
+import pandas as pd
+import pytest
+from ingest import read_vendor_csv
+from strategies import breakout, macd_strat, AwesomeOscillator
+from streaming import (StreamingBreakout, StreamingMACD,
+                       StreamingAwesomeOscillator)
+
+
+CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                   'spx_futures.csv')
+
+
+@pytest.fixture(scope='module')
+def spx():
+    return read_vendor_csv(CSV)
+
+
+def assert_same_signals(streamed, batch):
+    #same rows kept and the same signal on each
+    pd.testing.assert_index_equal(streamed.index, batch.index)
+    np.testing.assert_array_equal(streamed.to_numpy(), batch.to_numpy())
+
+
+@pytest.mark.parametrize('st, lt', [(50, 200), (5, 20)])
+def test_breakout_replay_matches_batch(spx, st, lt):
+    batch = breakout(spx.copy(), st, lt)['signal']
+    assert_same_signals(StreamingBreakout(st, lt).replay(spx), batch)
+
+
+@pytest.mark.parametrize('a, b, c', [(12, 26, 9), (5, 35, 5)])
+def test_macd_replay_matches_batch(spx, a, b, c):
+    batch = macd_strat(spx.copy(), a, b, c)['signal']
+    assert_same_signals(StreamingMACD(a, b, c).replay(spx), batch)
+
+
+@pytest.mark.parametrize('windows', [[34], [20, 34, 55]])
+def test_awesome_oscillator_replay_matches_batch(spx, windows):
+    ao = AwesomeOscillator([], windows)
+    batch = ao.raw_awesome_oscillator_strategy(spx.copy(), windows)['signal']
+    assert_same_signals(StreamingAwesomeOscillator(windows).replay(spx), batch)
+
+
+def test_awesome_oscillator_values_match_generate(spx):
+    windows = [20, 34]
+    ao = AwesomeOscillator([], windows)
+    expected = {window: ao.generate_awesome_oscillator(spx.copy(), window)
+                [f'awesome_oscillator_{window}_window'].to_numpy()
+                for window in windows}
+
+    stream = StreamingAwesomeOscillator(windows)
+    for i, bar in enumerate(spx[['High', 'Low']].to_dict('records')):
+        stream.update(bar)
+        for window, value in zip(windows, stream.get_oscillators()):
+            if math.isnan(expected[window][i]):
+                assert math.isnan(value)
+
+            else:
+                assert value == pytest.approx(expected[window][i], rel=1e-9,
+                                              abs=1e-9)
@@ -0,0 +1,215 @@
+import numpy as np
+
+#scikit-learn is only paid for by code that uses these transformers, the
+#rest of the package imports utils/backtest without it
+from sklearn.base import BaseEstimator, TransformerMixin
+
+from backtest import trading_costs
+
+
+class ZScorer(BaseEstimator, TransformerMixin):
+    '''
+    z-scores of columns added as {col}_z_score. 'full' mode scales by the
+    mean and std of the whole history, which looks ahead. 'expanding' and
+    'rolling' modes are point-in-time - each date only uses data up to it -
+    and keep running state so live bars can be added with partial_fit
+    '''
+
+    def __init__(self, cols=None, mode='full', window=None, min_periods=None):
+        '''
+        params
+        ======
+        cols (list): columns to score
+        mode (str): 'full', 'expanding' or 'rolling'
+        window (int): lookback of rolling mode
+        min_periods (int): observations before a point-in-time score is
+                           given, see utils.RunningZScore
+        '''
+        if mode not in ('full', 'expanding', 'rolling'):
+            raise ValueError(f'Unknown ZScorer mode {mode}, use full, expanding or rolling')
+
+        if mode == 'rolling' and window is None:
+            raise ValueError('ZScorer rolling mode needs a window')
+
+        self._means = None
+        self._stds = None
+        self._cols = cols
+        self._mode = mode
+        self._window = window if mode == 'rolling' else None
+        self._min_periods = min_periods
+        self._running = None
+        self._z_scores = None
+
+    #getters
+    def get_mode(self):
+        return self._mode
+
+    def get_z_scores(self):
+        '''
+        latest point-in-time z-score of each column, after fit or partial_fit
+        '''
+        return self._z_scores
+
+    #worker functions
+    def _values(self, X):
+        return np.column_stack([np.asarray(X[col], dtype=np.float64)
+                                for col in self._cols])
+
+    def _running_scores(self, X):
+        from utils import RunningZScore
+
+        self._running = RunningZScore(self._window, self._min_periods)
+        z = self._running.batch(self._values(X))
+        self._set_latest(z[-1] if len(z) else np.full(len(self._cols), np.nan))
+        return z
+
+    def _set_latest(self, z):
+        self._z_scores = dict(zip(self._cols, z))
+
+    def fit(self, X, y=None):
+        try:
+            if self._mode != 'full':
+                self._running_scores(X)
+
+            return self
+
+        except Exception as err:
+            print(f'Exception occurred fitting data: {err}')
+
+    def partial_fit(self, X, y=None):
+        '''
+        add new rows (eg the latest bar) to the running point-in-time state,
+        their scores are available from get_z_scores
+        '''
+        from utils import RunningZScore
+
+        if self._mode == 'full':
+            raise ValueError('partial_fit needs expanding or rolling mode')
+
+        if self._running is None:
+            self._running = RunningZScore(self._window, self._min_periods)
+
+        for row in self._values(X):
+            self._set_latest(self._running.update(row))
+
+        return self
+
+    def fit_transform(self, X, y=None, **fit_params):
+        if self._mode == 'full':
+            return self.transform(X)
+
+        return self._assign(X, self._running_scores(X))
+
+    def _assign(self, X, z):
+        return X.assign(**{f'{col}_z_score': z[:, k]
+                           for k, col in enumerate(self._cols)})
+
+    def transform(self, X=None, y=None):
+        if self._mode != 'full':
+            #scores over X's own history, fitted state is left alone
+            from utils import RunningZScore
+
+            running = RunningZScore(self._window, self._min_periods)
+            return self._assign(X, running.batch(self._values(X)))
+
+        for col in self._cols:
+            try:
+                col_arr = np.array(X[col])
+                X[f'{col}_z_score'] = (col_arr - col_arr.mean()) / col_arr.std()
+
+
+            except Exception as err:
+                print(f'Error occurred transforming {col} to Z-Score: {err}')
+
+        return X
+
+
+class DollarValue(BaseEstimator, TransformerMixin):
+    '''
+    generating dollar values of returns using a custom transformer w/ Scikit built in.
+    Ultimately would like to use this in a custom SKL pipeline/featureunion
+    '''
+
+    def __init__(self, initial_amount=100.0, returns_col=None, costs_col=None):
+        '''
+        initializer for dollar value functions
+
+        params
+        ======
+        initial_amount (float): initial dollar amount to base analysis on
+        returns_col (str): columns of periodic pct returns in decimal format
+        costs_col (str): optional column of trading costs in return units, as
+                         added by TradingCosts
+
+        returns
+        =======
+        no return
+        '''
+
+        self._initial_amount = initial_amount
+        self._returns_col = returns_col
+        self._costs_col = costs_col
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X, y=None):
+        if self._returns_col == None:
+            #if there is no returns column passed must catch and verify
+            raise ValueError('Returns not available, please specify a valid column.')
+        try:
+            #flat before the first signal, so the entry cost on the first bar
+            #counts - as in backtest.portfolio_backtest
+            strat = X['signal'].shift(1, fill_value=0) * \
+                        X[self._returns_col].fillna(0)
+            if self._costs_col is not None:
+                strat = strat - X[self._costs_col]
+
+            return strat.cumsum().apply(np.exp)
+
+        except KeyError as kerr:
+            print(f'Error when generating final dollar value: {kerr}')
+
+
+class TradingCosts(BaseEstimator, TransformerMixin):
+    '''
+    pipeline stage adding a costs column (return units) computed from changes
+    in signal, see trading_costs. run before DollarValue with costs_col='costs'
+    '''
+
+    def __init__(self, commission=0.0, spread=0.0, impact=0.0, notional=1.0,
+                 multiplier=1.0, roll_col=None, roll_cost=0.0,
+                 volume_col='Volume', price_col='price'):
+        '''
+        params
+        ======
+        commission, spread, impact, notional, multiplier, roll_cost: see
+                    trading_costs
+        roll_col (str): boolean column flagging roll dates
+        volume_col (str): column of traded volume used for impact
+        price_col (str): column of prices used for impact
+        '''
+        self._commission = commission
+        self._spread = spread
+        self._impact = impact
+        self._notional = notional
+        self._multiplier = multiplier
+        self._roll_col = roll_col
+        self._roll_cost = roll_cost
+        self._volume_col = volume_col
+        self._price_col = price_col
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X, y=None):
+        use_volume = self._impact and self._volume_col in X.columns
+        costs = trading_costs(X['signal'],
+                              X[self._price_col] if use_volume else None,
+                              X[self._volume_col] if use_volume else None,
+                              self._commission, self._spread, self._impact,
+                              self._notional, self._multiplier,
+                              X[self._roll_col] if self._roll_col else None,
+                              self._roll_cost)
+
+        return X.assign(costs=costs)
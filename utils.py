@@ -1,69 +1,576 @@
-import pandas_datareader.data as web
 import datetime as dt
 import pandas as pd
 import numpy as np
+from profiling import profiled
 
-from sklearn.base import BaseEstimator, TransformerMixin
 
+def __getattr__(name):
+    #ZScorer lives in transformers.py so importing utils doesn't pull in
+    #sklearn - still importable from here
+    if name == 'ZScorer':
+        from transformers import ZScorer
+        return ZScorer
 
-class ZScorer(BaseEstimator, TransformerMixin):
-    def __init__(self, cols=None):
-        self._means = None
-        self._stds = None
-        self._cols = cols
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
-    def fit(self, X, y=None):
-        try:
-            return self
 
-        except Exception as err:
-            print(f'Exception occurred fitting data: {err}')
+def download_data(ticker, start_date, end_date=dt.datetime.today()):
+    '''
+    raw daily history for ticker from the network, indexed by date
+    '''
+    #network reader is only imported when something actually downloads
+    import pandas_datareader.data as web
 
+    #frame containing price data for given security in given date range
+    df = web.DataReader(name=ticker,data_source='yahoo',start=start_date,
+                        end=end_date)
 
-    def transform(self, X=None, y=None):
-        for col in self._cols:
-            try:
-                col_arr = np.array(X[col])
-                X[f'{col}_z_score'] = (col_arr - col_arr.mean()) / col_arr.std()
-
-
-            except Exception as err:
-                print(f'Error occurred transforming {col} to Z-Score: {err}')
-
-        return X
+    #convert index from string to datetime
+    df.index = pd.to_datetime(df.index)
+    df.index.name = 'Date'
+    return df
 
 
+@profiled('load')
 def get_data(ticker, start_date, end_date=dt.datetime.today(),
-            colname='Adj Close'):
+            colname='Adj Close', store=None):
+    '''
+    daily history for ticker with colname renamed to price
 
+    params
+    ======
+    ticker (str): ticker of security
+    start_date (datetime.date): first date of history
+    end_date (datetime.date): last date of history
+    colname (str): column used as the price series
+    store (datastore.MarketDataStore): local store to serve data from, only
+                                       missing dates go to the network
 
+    return
+    ======
+    pandas dataframe with Date column and price data, empty if the data
+    could not be loaded
+    '''
     try:
-        #frame containing price data for given security in given date range
-        df = web.DataReader(name=ticker,data_source='yahoo',start=start_date,
-                            end=end_date)
+        if store is not None:
+            df = store.get(ticker, start_date, end_date)
 
-        #convert index from string to datetime
-        df.index = pd.to_datetime(df.index)
+        else:
+            df = download_data(ticker, start_date, end_date)
 
     except Exception as err:
-        print(err)
+        print(f'Could not load {ticker}: {err}')
+        df = pd.DataFrame(columns=[colname],
+                          index=pd.DatetimeIndex([], name='Date'))
 
     return df.rename(columns={colname:'price'}).reset_index()
 
-def ewma_vectorized(ser, window):
+def quarter_ends(start_date, end_date=dt.datetime.today()):
+    '''
+    calendar quarter-end rebalance dates between start and end
+
+    params
+    ======
+    start_date (datetime-like): first date of range
+    end_date (datetime-like): last date of range
+
+    return
+    ======
+    list of datetime.date quarter ends
+    '''
+    return [d.date() for d in pd.date_range(start_date, end_date, freq='QE')]
+
+
+def align_frames(frames, markets, cols=('price', 'High', 'Low', 'Close'),
+                calendar='union', fill='ffill', fill_limit=None):
+    '''
+    align separate per-market frames onto one date calendar as contiguous
+    float64 (dates x markets) arrays so cross-sectional work is one array op
+
+    params
+    ======
+    frames (list): per-market dataframes, as returned by get_data
+    markets (list): identifier for each frame
+    cols (iterable): columns to extract into arrays
+    calendar (str/pd.DatetimeIndex): 'union' of all dates, 'intersection' of
+                                     dates every market traded, or an explicit
+                                     index of dates
+    fill (str): 'ffill' to carry last observation forward, None to leave gaps
+    fill_limit (int): max consecutive dates to carry an observation forward
+
+    return
+    ======
+    dictionary with 'dates', 'markets', one (dates x markets) array per column
+    and 'mask' - True where a market actually printed on that date
+    '''
+    if len(frames) != len(markets):
+        raise ValueError(f'{len(frames)} frames passed for {len(markets)} markets')
+
+    #date arrays for each market, sorted and deduplicated
+    indexed = []
+    for market, df in zip(markets, frames):
+        if 'Date' in df.columns:
+            df = df.set_index('Date')
+
+        #a market that failed to load is empty and left as a gap, one that
+        #loaded without a requested column would silently be all nan
+        missing = [col for col in cols if col not in df.columns]
+        if missing and len(df):
+            raise ValueError(f'{market} has no {missing} column(s)')
+
+        df = df.set_axis(pd.to_datetime(df.index))
+        df = df[~df.index.duplicated(keep='last')].sort_index()
+        indexed.append(df)
+
+    if isinstance(calendar, str):
+        date_sets = [df.index.values for df in indexed]
+        if calendar == 'union':
+            dates = np.unique(np.concatenate(date_sets)) if date_sets else \
+                        np.array([], dtype='datetime64[ns]')
+
+        elif calendar == 'intersection':
+            dates = date_sets[0]
+            for other in date_sets[1:]:
+                dates = np.intersect1d(dates, other)
+
+        else:
+            raise ValueError(f'Unknown calendar {calendar}, use union or intersection')
+
+        dates = pd.DatetimeIndex(dates, name='Date')
+
+    else:
+        dates = pd.DatetimeIndex(calendar, name='Date')
+
+    n_dates, n_markets = len(dates), len(markets)
+    panel = {'dates': dates, 'markets': list(markets)}
+    panel['mask'] = np.zeros((n_dates, n_markets), dtype=bool)
+    for col in cols:
+        panel[col] = np.full((n_dates, n_markets), np.nan, dtype=np.float64)
+
+    #scatter each market into its rows of the calendar
+    for j, df in enumerate(indexed):
+        pos = dates.get_indexer(df.index)
+        found = pos >= 0
+        rows = pos[found]
+        panel['mask'][rows, j] = True
+
+        for col in cols:
+            if col in df.columns:
+                panel[col][rows, j] = df[col].to_numpy(dtype=np.float64)[found]
+
+    if fill == 'ffill':
+        #index of last observed row at or before each row, per market
+        rows = np.arange(n_dates)[:, np.newaxis]
+        last_seen = np.maximum.accumulate(np.where(panel['mask'], rows, -1),
+                                          axis=0)
+        fillable = (last_seen >= 0) & ~panel['mask']
+        if fill_limit is not None:
+            fillable &= (rows - last_seen) <= fill_limit
+
+        src = np.where(fillable, last_seen, rows)
+        cols_idx = np.arange(n_markets)[np.newaxis, :]
+        for col in cols:
+            panel[col] = np.ascontiguousarray(panel[col][src, cols_idx])
+
+    elif fill is not None:
+        raise ValueError(f'Unknown fill policy {fill}, use ffill or None')
+
+    return panel
+
+
+def get_panel(tickers, start_date, end_date=dt.datetime.today(),
+              colname='Adj Close', cols=('price', 'High', 'Low', 'Close'),
+              calendar='union', fill='ffill', fill_limit=None, store=None):
+    '''
+    load many tickers into one date-aligned panel, see align_frames
+
+    return
+    ======
+    dictionary with 'dates', 'markets', one (dates x markets) array per column
+    and 'mask' of observed dates
+    '''
+    frames = [get_data(ticker, start_date, end_date, colname, store)
+              for ticker in tickers]
+    return align_frames(frames, tickers, cols, calendar, fill, fill_limit)
+
+
+class EWMA(object):
+    '''
+    numerically stable exponentially weighted moving average, matching
+    pandas ewm(...).mean() with ignore_na=False. history is run through a
+    compiled recursive filter (no growing powers of the decay, so it can't
+    overflow on long series) and the state is kept so new bars can be added
+    one at a time
+
+    with adjust=False, an observation after g missing values is blended with
+    weight alpha against (1 - alpha) ** (g + 1) on the previous mean, as
+    pandas does. pandas 3.0 departs from its own rule at alpha exactly 0.5
+    (span=3, com=1), where it weights the previous mean by (1 - alpha) **
+    (g + 1) and the new value by the remainder - this class does not copy
+    that, eg [1, 2, nan, 4, 5] with span=3 gives 3.1667 here, 3.375 in pandas
+
+    params
+    ======
+    span (float): decay in terms of span, alpha = 2 / (span + 1)
+    alpha (float): smoothing factor directly, used if span not given
+    adjust (bool): divide by decaying sum of weights (pandas default) or use
+                   the recursive form y_t = (1 - alpha) * y_t-1 + alpha * x_t
+    min_periods (int): observations required before a value is returned
+    '''
+
+    def __init__(self, span=None, alpha=None, adjust=True, min_periods=0):
+        if alpha is None:
+            if span is None or span < 1:
+                raise ValueError(f'EWMA needs span >= 1 or alpha, got span={span}')
+
+            alpha = 2 / (span + 1.0)
+
+        if not 0 < alpha <= 1:
+            raise ValueError(f'EWMA alpha must be in (0, 1], got {alpha}')
+
+        self._alpha = alpha
+        self._adjust = adjust
+        self._min_periods = min_periods
+
+        #running state per column - current mean, weight behind it, obs count
+        self._mean = None
+        self._old_wt = None
+        self._nobs = None
+
+    #getters
+    def get_alpha(self):
+        return self._alpha
+
+    def get_mean(self):
+        return self._value(self._mean, self._nobs)
+
+    #worker functions
+    def _value(self, mean, nobs):
+        if mean is None:
+            return None
+
+        return np.where(nobs >= max(self._min_periods, 1), mean, np.nan)
+
+    def batch(self, x):
+        '''
+        EWMA of full history, dates along first axis (dates or dates x markets).
+        leaves state at the last row so update can carry on from there
+
+        params
+        ======
+        x (array-like): values to average, nan treated as missing
+
+        return
+        ======
+        np.ndarray of same shape as x
+        '''
+        from scipy.signal import lfilter
+
+        x = np.asarray(x, dtype=np.float64)
+        valid = ~np.isnan(x)
+        nobs = np.cumsum(valid, axis=0)
+
+        if not self._adjust and (valid & (nobs > 1) &
+                                 ~np.roll(valid, 1, axis=0))[1:].any():
+            mean, old_wt = self._gapped(x)
+            self._mean = mean[-1].copy()
+            self._old_wt = old_wt.reshape(x.shape[1:])
+            self._nobs = nobs[-1].copy()
+            return self._value(mean, nobs)
+
+        #new observations get weight 1 (adjust) or alpha after the first
+        weights = valid.astype(np.float64)
+        if not self._adjust:
+            weights[valid & (nobs > 1)] = self._alpha
+
+        #y_t = z_t + (1 - alpha) * y_t-1 for both the weighted sum and weights
+        decay = [1.0, self._alpha - 1.0]
+        num = lfilter([1.0], decay, np.where(valid, weights * x, 0.0), axis=0)
+        den = lfilter([1.0], decay, weights, axis=0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = num / den
+
+        mean[nobs == 0] = np.nan
+
+        if len(x):
+            self._mean = mean[-1].copy()
+            self._old_wt = den[-1].copy()
+            self._nobs = nobs[-1].copy()
+
+        return self._value(mean, nobs)
+
+    def _gapped(self, x):
+        '''
+        recursive (adjust=False) form over history with gaps. the blend
+        renormalizes after a gap, so only the first value of each run of
+        observations has its own weight - the rest of the run is the fixed
+        coefficient filter, and the loop is over gaps rather than rows
+
+        return
+        ======
+        (mean shaped like x, weight behind the last mean per column)
+        '''
+        from scipy.signal import lfilter
+
+        alpha = self._alpha
+        decay = 1.0 - alpha
+        cols = x.reshape(len(x), -1)
+        mean = np.full(cols.shape, np.nan)
+        old_wt = np.ones(cols.shape[1])
+        rows = np.arange(len(x))
 
-    alpha = 2 / (window + 1.0)
-    alpha_rev = 1 - alpha
+        for j in range(cols.shape[1]):
+            col = cols[:, j]
+            obs = np.flatnonzero(~np.isnan(col))
+            if not len(obs):
+                continue
 
-    scale = 1 / alpha_rev
-    n = len(ser)
+            last, value = None, np.nan
+            for run in np.split(obs, np.flatnonzero(np.diff(obs) > 1) + 1):
+                start, end = run[0], run[-1] + 1
+                if last is None:
+                    value = col[start]
 
-    r = np.arange(n)
-    scale_arr = scale ** r
-    offset = ser[0] * alpha_rev ** (r + 1)
-    pw0 = alpha * alpha_rev ** (n - 1)
-    print(pw0)
+                else:
+                    #previous mean decays over every row since it was set
+                    weight = decay ** (start - last)
+                    value = (weight * value + alpha * col[start]) / \
+                                (weight + alpha)
 
-    mult = ser * pw0 * scale_arr
-    cumsums = mult.cumsum()
-    return  offset + cumsums * scale_arr[::-1]
+                mean[start, j] = value
+                if end - start > 1:
+                    mean[start + 1:end, j] = lfilter([alpha], [1.0, -decay],
+                                                     col[start + 1:end],
+                                                     zi=[decay * value])[0]
+
+                last, value = end - 1, mean[end - 1, j]
+
+            #missing rows carry the last mean
+            seen = np.maximum.accumulate(np.where(~np.isnan(col), rows, -1))
+            mean[seen >= 0, j] = mean[seen[seen >= 0], j]
+            old_wt[j] = decay ** (len(x) - 1 - obs[-1])
+
+        return mean.reshape(x.shape), old_wt
+
+    def update(self, x):
+        '''
+        add one bar (a scalar or one value per market) to the running average
+
+        params
+        ======
+        x (float/array-like): newest values, nan treated as missing
+
+        return
+        ======
+        current EWMA value(s)
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        obs = ~np.isnan(x)
+        new_wt = 1.0 if self._adjust else self._alpha
+
+        if self._mean is None:
+            self._mean = np.where(obs, x, np.nan)
+            self._old_wt = np.ones_like(x)
+            self._nobs = obs.astype(np.int64)
+            return self.get_mean()
+
+        started = self._nobs > 0
+        self._old_wt = np.where(started, self._old_wt * (1 - self._alpha),
+                                self._old_wt)
+
+        step = obs & started
+        with np.errstate(invalid='ignore'):
+            blended = (self._old_wt * self._mean + new_wt * x) / \
+                        (self._old_wt + new_wt)
+
+        self._mean = np.where(step, blended, np.where(obs, x, self._mean))
+        self._old_wt = np.where(step, self._old_wt + new_wt if self._adjust
+                                else 1.0, np.where(obs, 1.0, self._old_wt))
+        self._nobs = self._nobs + obs
+
+        return self.get_mean()
+
+
+class RunningZScore(object):
+    '''
+    point-in-time z-score - each date is scaled by the mean and standard
+    deviation of data up to and including it, over an expanding history or a
+    rolling window. state is kept as welford running mean and sum of squared
+    deviations, so new bars are added (and rolling bars removed) in O(1)
+
+    params
+    ======
+    window (int): rolling lookback, None for an expanding history
+    min_periods (int): observations required before a value is returned,
+                       defaults to window (rolling) or 2 (expanding)
+    ddof (int): delta degrees of freedom of the standard deviation
+    '''
+
+    def __init__(self, window=None, min_periods=None, ddof=0):
+        if window is not None and window < 2:
+            raise ValueError(f'RunningZScore window must be >= 2, got {window}')
+
+        if min_periods is None:
+            min_periods = window if window is not None else 2
+
+        self._window = window
+        self._min_periods = max(min_periods, ddof + 1)
+        self._ddof = ddof
+
+        #running state per column - obs count, mean, sum of squared deviations
+        self._nobs = None
+        self._mean = None
+        self._m2 = None
+
+        #last window values, oldest at self._pos, for rolling removal
+        self._ring = None
+        self._pos = 0
+
+    #getters
+    def get_window(self):
+        return self._window
+
+    def get_mean(self):
+        if self._mean is None:
+            return None
+
+        return np.where(self._nobs >= self._min_periods, self._mean, np.nan)
+
+    def get_std(self):
+        if self._mean is None:
+            return None
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var = np.maximum(self._m2, 0.0) / (self._nobs - self._ddof)
+
+        return np.where(self._nobs >= self._min_periods, np.sqrt(var), np.nan)
+
+    #worker functions
+    def _score(self, x, mean, std):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            z = (x - mean) / std
+
+        #flat history has no scale
+        return np.where(std > 0, z, np.nan)
+
+    def _reset(self, shape):
+        self._nobs = np.zeros(shape, dtype=np.int64)
+        self._mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)
+        if self._window is not None:
+            self._ring = np.full((self._window,) + shape, np.nan)
+            self._pos = 0
+
+    def batch(self, x):
+        '''
+        z-scores of a full history, dates along first axis (dates or dates x
+        columns). leaves state at the last row so update can carry on
+
+        params
+        ======
+        x (array-like): values to score, nan treated as missing
+
+        return
+        ======
+        np.ndarray of same shape as x
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        frame = pd.DataFrame(x.reshape(len(x), -1))
+
+        #pandas' compiled online mean/variance, all columns at once
+        if self._window is None:
+            roll = frame.expanding(self._min_periods)
+
+        else:
+            roll = frame.rolling(self._window, self._min_periods)
+
+        mean = roll.mean().to_numpy()
+        std = roll.std(ddof=self._ddof).to_numpy()
+        z = self._score(frame.to_numpy(), mean, std).reshape(x.shape)
+
+        #state from the history still in scope
+        tail = x if self._window is None else x[-self._window:]
+        self._reset(x.shape[1:])
+        if len(tail):
+            valid = ~np.isnan(tail)
+            self._nobs = valid.sum(axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self._mean = np.where(self._nobs > 0, np.where(valid, tail, 0.0)
+                                      .sum(axis=0) / self._nobs, 0.0)
+
+            self._m2 = np.where(valid, tail - self._mean, 0.0) ** 2
+            self._m2 = self._m2.sum(axis=0)
+
+            if self._window is not None:
+                self._ring[self._window - len(tail):] = tail
+
+        return z
+
+    def update(self, x):
+        '''
+        add one bar (a scalar or one value per column) and score it
+
+        params
+        ======
+        x (float/array-like): newest values, nan treated as missing
+
+        return
+        ======
+        z-score(s) of the newest values
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        if self._mean is None:
+            self._reset(x.shape)
+
+        if self._window is not None:
+            #drop the bar leaving the window
+            old = self._ring[self._pos]
+            leaving = ~np.isnan(old)
+            nobs = self._nobs - leaving
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = self._mean - np.where(leaving, old - self._mean, 0.0) / nobs
+
+            self._m2 = self._m2 - np.where(leaving, (old - self._mean) *
+                                           (old - mean), 0.0)
+            self._mean = np.where(nobs > 0, mean, 0.0)
+            self._m2 = np.where(nobs > 0, self._m2, 0.0)
+            self._nobs = nobs
+
+            self._ring[self._pos] = x
+            self._pos = (self._pos + 1) % self._window
+
+        obs = ~np.isnan(x)
+        self._nobs = self._nobs + obs
+        delta = np.where(obs, x - self._mean, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self._mean = self._mean + np.where(obs, delta / self._nobs, 0.0)
+
+        self._m2 = self._m2 + np.where(obs, delta * (x - self._mean), 0.0)
+
+        return self._score(x, self.get_mean(), self.get_std())
+
+
+def ewma(x, span=None, alpha=None, adjust=True, min_periods=0):
+    '''
+    exponentially weighted moving average over full history, see EWMA
+
+    params
+    ======
+    x (array-like): values with dates along first axis (dates x markets ok)
+    span (float): decay in terms of span
+    alpha (float): smoothing factor, used if span not given
+    adjust (bool): pandas adjust mode
+    min_periods (int): observations required before a value is returned
+
+    return
+    ======
+    np.ndarray of same shape as x
+    '''
+    return EWMA(span, alpha, adjust, min_periods).batch(x)
+
+
+def ewma_vectorized(ser, window):
+    #kept for existing callers - recursive (adjust=False) form seeded with
+    #the first value
+    return ewma(ser, span=window, adjust=False)
@@ -0,0 +1,237 @@
+import itertools
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from sweep import STRATEGIES, FIELDS, _share
+from utils import quarter_ends
+
+
+#per-worker views onto the shared price and strategy returns blocks, set by
+#_attach
+_shared = dict()
+
+
+def walk_forward_splits(dates, rebals, train_periods=4, anchored=False):
+    '''
+    train/test folds between rebalance dates. each fold trains on the
+    train_periods rebalance periods before a rebalance date (or everything
+    before it when anchored) and tests on the period that follows
+
+    params
+    ======
+    dates (pd.DatetimeIndex): sorted dates of the price history
+    rebals (list): rebalance dates, eg utils.quarter_ends
+    train_periods (int): rebalance periods in each rolling train window
+    anchored (bool): train from the start of history every fold
+
+    return
+    ======
+    list of (train_start, train_end, test_start, test_end) integer positions,
+    end exclusive
+    '''
+    dates = pd.DatetimeIndex(dates)
+    edges = np.searchsorted(dates.values,
+                            pd.DatetimeIndex(sorted(rebals)).values, 'right')
+    edges = np.unique(np.concatenate([edges, [len(dates)]]))
+
+    folds = []
+    for k in range(train_periods, len(edges) - 1):
+        train_start = 0 if anchored else edges[k - train_periods]
+        if edges[k + 1] > edges[k]:
+            folds.append((int(train_start), int(edges[k]), int(edges[k]),
+                          int(edges[k + 1])))
+
+    return folds
+
+
+def score(strat, metric='sharpe', periods_per_year=252):
+    '''
+    score each row of a (param sets x dates) matrix of strategy log returns
+
+    params
+    ======
+    strat (np.ndarray): strategy log returns, one row per parameter set
+    metric (str): 'sharpe', 'total_return' or 'max_drawdown'
+    periods_per_year (int): used to annualize
+
+    return
+    ======
+    np.ndarray with one score per row, higher is better
+    '''
+    if metric == 'total_return':
+        return strat.sum(axis=1)
+
+    if metric == 'sharpe':
+        vol = strat.std(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sharpe = strat.mean(axis=1) / vol * np.sqrt(periods_per_year)
+
+        return np.where(vol > 0, sharpe, -np.inf)
+
+    if metric == 'max_drawdown':
+        equity = np.cumsum(strat, axis=1)
+        peak = np.maximum.accumulate(np.maximum(equity, 0.0), axis=1)
+        return (equity - peak).min(axis=1)
+
+    raise ValueError(f'Unknown metric {metric}, use sharpe, total_return or max_drawdown')
+
+
+def _strategy_returns(df, func, param_sets):
+    '''
+    full-history strategy log returns for each parameter set, indicators are
+    computed once here and then only sliced per fold
+    '''
+    log_returns = np.log(df['price']).diff().to_numpy()
+    strat = np.zeros((len(param_sets), len(df)))
+
+    for i, params in enumerate(param_sets):
+        out = func(df.copy(), **params)
+
+        #rows dropped by the strategy are flat, yesterday's signal earns today
+        signal = out['signal'].reindex(df.index).fillna(0.0).to_numpy()
+        strat[i, 1:] = np.nan_to_num(signal[:-1] * log_returns[1:])
+
+    return strat
+
+
+def _attach(prices_name, n_rows, returns_name, shape):
+    #runs once per worker, keeps both segments open for the life of the process
+    for key, name, block_shape in (('prices', prices_name, (n_rows, len(FIELDS))),
+                                   ('returns', returns_name, shape)):
+        shm = shared_memory.SharedMemory(name=name)
+        _shared[f'{key}_shm'] = shm
+        _shared[key] = np.ndarray(block_shape, dtype=np.float64, buffer=shm.buf)
+
+
+def _returns(task):
+    '''
+    strategy returns of one market for a batch of parameter sets, written
+    straight into their rows of the shared returns block
+    '''
+    strategy, start, end, first, param_sets = task
+    func = STRATEGIES.get(strategy, strategy)
+
+    df = pd.DataFrame(_shared['prices'][start:end],
+                      columns=FIELDS).dropna(axis=1, how='all')
+    _shared['returns'][first:first + len(param_sets), start:end] = \
+        _strategy_returns(df, func, param_sets)
+
+
+def _fold(block, offset, fold, metric, periods_per_year):
+    train_start, train_end, test_start, test_end = fold
+
+    #optimize on the train window, apply the winner out of sample
+    train = block[:, offset + train_start:offset + train_end]
+    scores = score(train, metric, periods_per_year)
+    best = int(np.argmax(scores))
+    test = block[best, offset + test_start:offset + test_end].copy()
+
+    return best, scores[best], test
+
+
+def walk_forward(data, strategy, grid, rebals=None, train_periods=4,
+                 anchored=False, metric='sharpe', where=None, max_workers=None,
+                 batch_size=64, periods_per_year=252):
+    '''
+    walk-forward optimization - re-optimize strategy parameters on each train
+    window, trade the winner over the following test window and stitch the
+    out of sample returns together. strategy returns for every market and
+    parameter set are computed in parallel from prices in shared memory,
+    each fold then only slices them
+
+    params
+    ======
+    data (dict): {market : dataframe} with price (High/Low for awesome)
+    strategy (str/func): key of sweep.STRATEGIES or picklable function of form
+                         func(df, **params) returning frame with signal
+    grid (dict): {param name : list of values}
+    rebals (list): rebalance dates splitting folds, defaults to quarter ends
+    train_periods (int): rebalance periods in each rolling train window
+    anchored (bool): train from start of history every fold
+    metric (str): train window objective, see score
+    where (func): optional filter on a parameter dict, eg st < lt
+    max_workers (int): worker processes, defaults to cpu count
+    batch_size (int): parameter sets per task
+    periods_per_year (int): used to annualize
+
+    return
+    ======
+    dictionary with 'folds' (one row per market and fold with the chosen
+    parameters), 'oos_returns' (dates x markets out of sample log returns)
+    and 'equity' (compounded out of sample equity per market)
+    '''
+    names = list(grid)
+    param_sets = [dict(zip(names, values))
+                  for values in itertools.product(*grid.values())]
+    if where is not None:
+        param_sets = [params for params in param_sets if where(params)]
+
+    frames = dict()
+    for market, df in data.items():
+        if 'Date' in df.columns:
+            df = df.set_index('Date')
+
+        frames[market] = df.sort_index()
+
+    prices, offsets = _share(frames)
+    shape = (len(param_sets), int(offsets[-1]))
+    returns = shared_memory.SharedMemory(create=True,
+                                         size=max(shape[0] * shape[1], 1) * 8)
+    try:
+        block = np.ndarray(shape, dtype=np.float64, buffer=returns.buf)
+
+        tasks = []
+        for i in range(len(frames)):
+            for k in range(0, len(param_sets), batch_size):
+                tasks.append((strategy, offsets[i], offsets[i+1], k,
+                              param_sets[k:k+batch_size]))
+
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_attach,
+                                 initargs=(prices.name, offsets[-1],
+                                           returns.name, shape)) as pool:
+            list(pool.map(_returns, tasks))
+
+        #a fold is an argmax and a slice, cheaper here than shipping to a worker
+        folds = []
+        for i, (market, df) in enumerate(frames.items()):
+            market_rebals = rebals if rebals is not None else \
+                                quarter_ends(df.index[0], df.index[-1])
+
+            for fold in walk_forward_splits(df.index, market_rebals,
+                                            train_periods, anchored):
+                folds.append((market, fold, _fold(block, offsets[i], fold,
+                                                  metric, periods_per_year)))
+
+        #no views may outlive the segment
+        del block
+
+    finally:
+        for shm in (prices, returns):
+            shm.close()
+            shm.unlink()
+
+    rows = []
+    oos = {market: pd.Series(np.nan, index=df.index)
+           for market, df in frames.items()}
+
+    for market, fold, (best, train_score, test) in folds:
+        dates = frames[market].index
+        train_start, train_end, test_start, test_end = fold
+        oos[market].iloc[test_start:test_end] = test
+
+        rows.append({'market': market,
+                     'train_start': dates[train_start],
+                     'train_end': dates[train_end - 1],
+                     'test_start': dates[test_start],
+                     'test_end': dates[test_end - 1],
+                     **param_sets[best],
+                     f'train_{metric}': train_score,
+                     'test_return': np.expm1(test.sum())})
+
+    oos_returns = pd.DataFrame(oos)
+    equity = oos_returns.fillna(0.0).cumsum().apply(np.exp).where(
+                oos_returns.notna().cumsum() > 0)
+
+    return {'folds': pd.DataFrame(rows), 'oos_returns': oos_returns,
+            'equity': equity}